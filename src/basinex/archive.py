@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Consolidated output of many basins. The files of every gauge are written
+to a temporary directory first and then streamed into a shard archive
+(tar or zip) holding up to 'shard_size' gauges, so the output file system
+only sees a few large files instead of a directory tree per gauge.
+unpack restores the classic layout (i.e. 'outpath/<id>/...') for mHM.
+"""
+
+import logging
+import os
+import shutil
+import tarfile
+import tempfile
+import zipfile
+
+# file name extension and tarfile mode of the supported formats
+ARCHIVE_FORMATS = {
+    "tar": (".tar", "w"),
+    "tar.gz": (".tar.gz", "w:gz"),
+    "zip": (".zip", None),
+}
+
+
+class Archive(object):
+    def __init__(self, outpath, format="tar", shard_size=1000, tmpdir=None):
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError(
+                "Supported archive formats are: {:}".format(
+                    ", ".join(ARCHIVE_FORMATS.keys())
+                )
+            )
+        self.outpath = outpath
+        self.format = format
+        self.shard_size = max(int(shard_size), 1)
+        self.tmpdir = tempfile.mkdtemp(prefix="basinex_", dir=tmpdir)
+        self._fobj = None
+        self._fname = None
+        self._count = 0
+
+    def gaugePath(self, gauge_id):
+        # directory the files of the given gauge are written to
+        return os.path.join(self.tmpdir, str(gauge_id))
+
+    def _open(self, gauge_id):
+        ext, mode = ARCHIVE_FORMATS[self.format]
+        os.makedirs(self.outpath, exist_ok=True)
+        # shards are named after their first gauge, so runs for different
+        # gauges (i.e. --line) don't write to the same archive
+        self._fname = os.path.join(self.outpath, "basins_{:}{:}".format(gauge_id, ext))
+        # incomplete archives keep the suffix '.part'
+        if mode is None:
+            self._fobj = zipfile.ZipFile(
+                self._fname + ".part", "w", compression=zipfile.ZIP_DEFLATED
+            )
+        else:
+            self._fobj = tarfile.open(self._fname + ".part", mode)
+        self._count = 0
+
+    def _close(self):
+        if self._fobj is not None:
+            self._fobj.close()
+            os.replace(self._fname + ".part", self._fname)
+            logging.debug("wrote archive: %s", self._fname)
+        self._fobj = None
+
+    def add(self, gauge_id):
+        """
+        Arguments
+        ---------
+        gauge_id : str
+
+        Returns
+        -------
+        None
+
+        Purpose
+        -------
+        Move the files of the given gauge into the current shard archive.
+        """
+        path = self.gaugePath(gauge_id)
+        if not os.path.isdir(path):
+            return
+        if self._fobj is None:
+            self._open(gauge_id)
+
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                fname = os.path.join(root, name)
+                arcname = os.path.relpath(fname, self.tmpdir)
+                if isinstance(self._fobj, zipfile.ZipFile):
+                    self._fobj.write(fname, arcname)
+                else:
+                    # hardlinked files (see deduplicate) are stored in full,
+                    # the other link might be in another shard
+                    info = self._fobj.gettarinfo(fname, arcname)
+                    info.type, info.linkname = tarfile.REGTYPE, ""
+                    info.size = os.path.getsize(fname)
+                    with open(fname, "rb") as f:
+                        self._fobj.addfile(info, f)
+        shutil.rmtree(path)
+
+        self._count += 1
+        if self._count >= self.shard_size:
+            self._close()
+
+    def close(self, keep=False):
+        """
+        Arguments
+        ---------
+        keep : bool  # keep the temporary directory, e.g. after an error
+
+        Returns
+        -------
+        None
+
+        Purpose
+        -------
+        Close the current shard archive and remove the temporary directory.
+        Gauges not yet packed (e.g. the deferred ncfiles of a failed run)
+        are kept there, if requested.
+        """
+        self._close()
+        if keep:
+            logging.warning("unpacked output kept in: %s", self.tmpdir)
+            return
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+
+def _members(fobj):
+    # member names of a tar or zip archive
+    if isinstance(fobj, zipfile.ZipFile):
+        return fobj.namelist()
+    return fobj.getnames()
+
+
+def unpack(fnames, outpath="."):
+    """
+    Arguments
+    ---------
+    fnames  : list of str  # archives written with the 'archive' option
+    outpath : str          # output directory
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Extract the given archives, i.e. restore the 'outpath/<id>/...'
+    directory layout expected by mHM.
+    """
+    for fname in fnames:
+        logging.info("unpacking: %s", fname)
+        if zipfile.is_zipfile(fname):
+            fobj = zipfile.ZipFile(fname, "r")
+        else:
+            fobj = tarfile.open(fname, "r:*")
+        with fobj:
+            for name in _members(fobj):
+                parts = name.replace("\\", "/").split("/")
+                if os.path.isabs(name) or ".." in parts:
+                    raise ValueError(
+                        "Invalid member '{:}' in archive: {:}".format(name, fname)
+                    )
+            fobj.extractall(outpath)
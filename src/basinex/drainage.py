@@ -0,0 +1,455 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Whole grid operations on the D8 flow direction grid (ESRI encoding),
+i.e. the basins of all gauges are derived in a single pass over the
+grid instead of one 'extract' call per gauge.
+"""
+
+import csv
+import logging
+import os
+import warnings
+
+import numpy as np
+
+from . import geoarray as ga
+from .extractor import labelBasins
+from .gauges import matchFlowacc
+
+# flow direction -> (row, column) offset of the downstream cell
+D8_OFFSETS = {
+    1: (0, 1),
+    2: (1, 1),
+    4: (1, 0),
+    8: (1, -1),
+    16: (0, -1),
+    32: (-1, -1),
+    64: (-1, 0),
+    128: (-1, 1),
+}
+
+LABEL_FILL_VALUE = -9999
+
+
+def downstreamCells(flowdir):
+    """
+    Arguments
+    ---------
+    flowdir : GeoArray  # D8 flow direction
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+
+    Purpose
+    -------
+    Return the row and column indices of the downstream cell of every
+    cell. Cells draining out of the grid, into fill values or without
+    a valid flow direction (i.e. sinks) are set to -1.
+    """
+    data = np.asarray(flowdir.data)
+    nrows, ncols = data.shape
+    yout = np.full(data.shape, -1, dtype=np.int64)
+    xout = np.full(data.shape, -1, dtype=np.int64)
+    for code, (dy, dx) in D8_OFFSETS.items():
+        rows, cols = np.nonzero(data == code)
+        yout[rows, cols] = rows + dy
+        xout[rows, cols] = cols + dx
+
+    valid = (yout >= 0) & (yout < nrows) & (xout >= 0) & (xout < ncols)
+    valid[valid] = ~np.ma.getmaskarray(flowdir)[yout[valid], xout[valid]]
+    yout[~valid] = -1
+    xout[~valid] = -1
+    return yout, xout
+
+
+def downstreamCell(flowdir, row, col):
+    # index of the cell downstream of (row, col) or None, see downstreamCells
+    offset = D8_OFFSETS.get(int(flowdir.data[row, col]))
+    if offset is None:
+        return None
+    row, col = row + offset[0], col + offset[1]
+    if row < 0 or row >= flowdir.nrows or col < 0 or col >= flowdir.ncols:
+        return None
+    mask = np.ma.getmask(flowdir)
+    if mask is np.ma.nomask:
+        # not masked in full, e.g. in virtual memory
+        if flowdir.data[row, col] == flowdir.fill_value:
+            return None
+    elif mask[row, col]:
+        return None
+    return row, col
+
+
+def outletCells(flowdir, flowacc, threshold):
+    """
+    Arguments
+    ---------
+    flowdir   : GeoArray  # D8 flow direction
+    flowacc   : GeoArray  # flow accumulation
+    threshold : scalar    # minimal flow accumulation
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+
+    Purpose
+    -------
+    Return the row and column indices of all outlets, i.e. valid cells
+    draining out of the grid or into a sink, with a flow accumulation of
+    at least threshold. The outlets are given in row major order.
+    """
+    ydown, _ = downstreamCells(flowdir)
+    outlets = (
+        (ydown < 0)
+        & ~np.ma.getmaskarray(flowdir)
+        & (np.asarray(flowacc.data) >= threshold)
+    )
+    return np.nonzero(outlets)
+
+
+def gaugeCells(gauges, flowacc, matching):
+    """
+    Arguments
+    ---------
+    gauges   : list of Gauge
+    flowacc  : GeoArray  # flow accumulation
+    matching : dict      # gauge matching parameters of the input file
+
+    Returns
+    -------
+    list of (Gauge, (int, int))
+
+    Purpose
+    -------
+    Move the gauges onto the flow accumulation grid (see matchFlowacc)
+    and return them together with their cell indices. Gauges given as
+    a mask file or not matching the grid are skipped.
+    """
+    out = []
+    for gauge in gauges:
+        if gauge.path:
+            warnings.warn("Skipping gauge {:}, given as a mask file".format(gauge.id))
+            continue
+        if gauge.size:
+            matched = matchFlowacc(gauge, flowacc, **matching)
+            if not matched:
+                warnings.warn(
+                    "Failed to match the gauge {:} to the flow accumulation grid".format(
+                        gauge.id
+                    )
+                )
+                continue
+            gauge = matched
+        out.append((gauge, flowacc.indexOf(float(gauge.y), float(gauge.x))))
+    return out
+
+
+def labelGrid(flowdir, cells, ids, fill_value=LABEL_FILL_VALUE):
+    """
+    Arguments
+    ---------
+    flowdir    : GeoArray          # D8 flow direction
+    cells      : list of (int, int)  # row and column indices of the gauges
+    ids        : list of int         # gauge ids
+    fill_value : int
+
+    Returns
+    -------
+    GeoArray (int32)
+
+    Purpose
+    -------
+    Return a grid, holding the id of the nearest downstream gauge in every
+    cell. Cells not draining into any of the gauges are set to fill_value.
+    """
+    ids = np.asarray(ids, dtype=np.int32)
+    if np.any(ids == fill_value):
+        raise ValueError("Gauge ids must differ from {:}".format(fill_value))
+
+    cells = np.asarray(cells, dtype=np.int64).reshape(-1, 2)
+    # flowdir is read in place, only int32 grids are not copied
+    labels = labelBasins(
+        np.asarray(flowdir.data, dtype=np.int32),
+        np.ascontiguousarray(cells[:, 0], dtype=np.int_),
+        np.ascontiguousarray(cells[:, 1], dtype=np.int_),
+        ids,
+        fill_value,
+    )
+    header = dict(flowdir.header, fill_value=fill_value)
+    return ga.array(np.asarray(labels, dtype=np.int32), **header)
+
+
+def writeOutlets(fname, flowacc, cells, ids, scaling_factor=1):
+    # write the outlets as a gauges look up table (i.e. 'id;size;y;x')
+    cellarea = abs(np.prod(flowacc.cellsize)) * scaling_factor**2
+    ycs, xcs = (abs(c) for c in flowacc.cellsize)
+    yorigin, xorigin = flowacc.getCorner("ul")
+    with open(fname, "w", newline="") as f:
+        writer = csv.writer(f, delimiter=";")
+        writer.writerow(("id", "size", "y", "x"))
+        for gid, (yidx, xidx) in zip(ids, cells):
+            # cell centers
+            y = yorigin - (yidx + 0.5) * ycs
+            x = xorigin + (xidx + 0.5) * xcs
+            size = float(flowacc.data[yidx, xidx]) * cellarea
+            writer.writerow((gid, size, y, x))
+
+
+def writeLabels(config, gauges, fname, threshold=None):
+    """
+    Arguments
+    ---------
+    config    : dict          # content of the input file
+    gauges    : list of Gauge
+    fname     : str           # output file name
+    threshold : scalar/None   # minimal flow accumulation of the outlets
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Write the drainage label grid of the given gauges or, if a threshold
+    is given, of all outlets with a flow accumulation of at least threshold.
+    The outlets get consecutive ids and are written to a gauges look up
+    table next to fname.
+    """
+    cache = config.get("cache")
+
+    logging.debug("reading flow accumulation")
+    flowacc = ga.fromfile(config["flowacc"], cache=cache).astype(np.int32)
+
+    logging.debug("reading flow direction")
+    flowdir = ga.fromfile(config["flowdir"], cache=cache).astype(np.int32)
+
+    if threshold is not None:
+        cells = list(zip(*outletCells(flowdir, flowacc, threshold)))
+        ids = list(range(1, len(cells) + 1))
+        lutname = os.path.splitext(fname)[0] + ".txt"
+        logging.info("writing %d outlets to: %s", len(cells), lutname)
+        writeOutlets(lutname, flowacc, cells, ids, config["matching"]["scaling_factor"])
+    else:
+        matched = gaugeCells(gauges, flowacc, config["matching"])
+        try:
+            ids = [int(gauge.id) for gauge, _ in matched]
+        except ValueError:
+            raise ValueError("Gauge ids must be integers to be used as labels")
+        cells = [cell for _, cell in matched]
+
+    logging.info("labeling %d basins", len(cells))
+    labels = labelGrid(flowdir, cells, ids)
+
+    logging.info("writing labels: %s", fname)
+    path = os.path.dirname(fname)
+    if path:
+        os.makedirs(path, exist_ok=True)
+    labels.tofile(fname)
+
+
+class GaugeTree(object):
+    """
+    Purpose
+    -------
+    The nesting of the gauges on the river network. All gauges are matched
+    and labeled at once (see labelGrid), the parent of a gauge is the gauge
+    labeling the cell downstream of it. The basin mask of a gauge is the
+    union of its own (incremental) area and the masks of its children, so
+    nested basins are traced only once. The extents and cell counts of all
+    basins are derived up front, in one bottom-up sweep over the tree.
+    """
+
+    def __init__(self, flowacc, flowdir, gauges, matching):
+        self.flowacc = flowacc
+        self.flowdir = flowdir
+
+        # the matched gauges and their nodes, gauges sharing a cell
+        # share a node
+        self.gauges = {}
+        self.cells = {}
+        self._node = {}
+        nodes = {}
+        for gauge, cell in gaugeCells(gauges, flowacc, matching):
+            self.gauges[gauge.id] = gauge
+            self.cells[gauge.id] = cell
+            self._node[gauge.id] = nodes.setdefault(cell, len(nodes))
+        cells = sorted(nodes, key=nodes.get)
+
+        labels = np.asarray(
+            labelGrid(flowdir, cells, np.arange(1, len(cells) + 1), fill_value=0)
+        )
+
+        # cells of the incremental areas as flat indices, grouped by node
+        flat = np.flatnonzero(labels)
+        values = labels.ravel()[flat]
+        order = np.argsort(values, kind="stable")
+        flat = flat[order]
+        bounds = np.searchsorted(values[order], np.arange(1, len(cells) + 2))
+        self._cells = [flat[bounds[i] : bounds[i + 1]] for i in range(len(cells))]
+
+        self._parents = []
+        self._children = [[] for _ in cells]
+        for i, cell in enumerate(cells):
+            down = downstreamCell(flowdir, *cell)
+            parent = labels[down] - 1 if down is not None else -1
+            self._parents.append(parent)
+            if parent >= 0:
+                self._children[parent].append(i)
+
+        # the first gauge of every node, i.e. the reported parents
+        self._ids = {}
+        for gauge_id, node in self._node.items():
+            self._ids.setdefault(node, gauge_id)
+
+        self._bounds, self._ncells = self._sweep(flat, bounds[:-1])
+
+    def _sweep(self, flat, starts):
+        # row/column bounds (i.e. top, bottom, left, right) and cell counts
+        # of the incremental areas, propagated from the upstream basins
+        # to their parents
+        out = np.zeros((len(self._cells), 4), dtype=np.int64)
+        ncells = np.array([len(c) for c in self._cells], dtype=np.int64)
+        if not len(flat):
+            return out, ncells
+        rows, cols = np.divmod(flat, self.flowdir.ncols)
+        out[:, 0] = np.minimum.reduceat(rows, starts)
+        out[:, 1] = np.maximum.reduceat(rows, starts)
+        out[:, 2] = np.minimum.reduceat(cols, starts)
+        out[:, 3] = np.maximum.reduceat(cols, starts)
+
+        # start at the headwaters, a parent is done once all its children are
+        pending = [len(c) for c in self._children]
+        stack = [i for i, n in enumerate(pending) if n == 0]
+        while stack:
+            node = stack.pop()
+            parent = self._parents[node]
+            if parent < 0:
+                continue
+            out[parent, [0, 2]] = np.minimum(out[parent, [0, 2]], out[node, [0, 2]])
+            out[parent, [1, 3]] = np.maximum(out[parent, [1, 3]], out[node, [1, 3]])
+            ncells[parent] += ncells[node]
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                stack.append(parent)
+        return out, ncells
+
+    def ncells(self, gauge_id):
+        # number of cells of the basin
+        return int(self._ncells[self._node[gauge_id]])
+
+    def bbox(self, gauge_id):
+        """
+        Arguments
+        ---------
+        gauge_id : str
+
+        Returns
+        -------
+        dict
+
+        Purpose
+        -------
+        Return the bounding box of the basin of the given gauge, i.e. the
+        bbox of its (trimmed) mask.
+        """
+        top, bottom, left, right = self._bounds[self._node[gauge_id]]
+        ycs, xcs = (abs(c) for c in self.flowdir.cellsize)
+        yorigin, xorigin = self.flowdir.getCorner("ul")
+        return {
+            "ymin": yorigin - (bottom + 1) * ycs,
+            "ymax": yorigin - top * ycs,
+            "xmin": xorigin + left * xcs,
+            "xmax": xorigin + (right + 1) * xcs,
+        }
+
+    def parent(self, gauge_id):
+        """
+        Arguments
+        ---------
+        gauge_id : str
+
+        Returns
+        -------
+        str or None
+
+        Purpose
+        -------
+        Return the id of the nearest downstream gauge.
+        """
+        parent = self._parents[self._node[gauge_id]]
+        return self._ids[parent] if parent >= 0 else None
+
+    def _subtree(self, node):
+        out, stack, seen = [], [node], {node}
+        while stack:
+            node = stack.pop()
+            out.append(node)
+            for child in self._children[node]:
+                # invalid flow directions might contain cycles
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        return out
+
+    def mask(self, gauge_id):
+        """
+        Arguments
+        ---------
+        gauge_id : str
+
+        Returns
+        -------
+        GeoArray
+
+        Purpose
+        -------
+        Return the basin mask of the given gauge, trimmed to its extent,
+        as gaugeBasinMask does.
+        """
+        node = self._node[gauge_id]
+        flat = np.concatenate([self._cells[n] for n in self._subtree(node)])
+        rows, cols = np.unravel_index(flat, self.flowdir.shape)
+        top, bottom, left, right = self._bounds[node]
+        window = self.flowdir.removeCells(
+            top=top,
+            left=left,
+            bottom=self.flowdir.nrows - bottom - 1,
+            right=self.flowdir.ncols - right - 1,
+        )
+        data = np.full(window.shape, self.flowdir.fill_value, dtype=np.int32)
+        data[rows - top, cols - left] = 1
+        return ga.array(data, **window.header)
+
+    def tofile(self, fname, bboxes=None):
+        """
+        Arguments
+        ---------
+        fname  : str        # output file name
+        bboxes : dict/None  # gauge id -> bbox, default: see bbox
+
+        Returns
+        -------
+        None
+
+        Purpose
+        -------
+        Write the nesting, cell counts and extents of all basins as a table.
+        """
+        path = os.path.dirname(fname)
+        if path:
+            os.makedirs(path, exist_ok=True)
+        keys = ("ymin", "ymax", "xmin", "xmax")
+        with open(fname, "w", newline="") as f:
+            writer = csv.writer(f, delimiter=";")
+            writer.writerow(("id", "parent", "ncells") + keys)
+            for gauge_id in self.gauges:
+                parent = self.parent(gauge_id)
+                bbox = (bboxes or {}).get(gauge_id) or self.bbox(gauge_id)
+                writer.writerow(
+                    (gauge_id, "" if parent is None else parent, self.ncells(gauge_id))
+                    + tuple(bbox[k] for k in keys)
+                )
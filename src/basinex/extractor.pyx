@@ -18,22 +18,38 @@ cdef vector[int] X_OFFSET = [-1,  0,  1, -1,  1,  -1,  0,  1]
 cdef vector[int] UPSTREAM_FDIRS = [ 2,  4,  8,  1, 16, 128, 64, 32]
 
 
-cpdef char[:,:] extract(int[:,:] fdir, long gauge_y, long gauge_x):
-    cdef char[:,:] mask = np.zeros_like(fdir, dtype=np.int8)
+cpdef tuple extract(const int[:,:] fdir, long gauge_y, long gauge_x):
+    # Return the basin mask of the gauge, cut to its extent, together with
+    # the row and column of its upper left cell. The basin is traced twice,
+    # first for its extent, so only the window is allocated. fdir is only
+    # read, i.e. it might be a read-only (e.g. memory-mapped) array.
     cdef stack[index] stck
     cdef index idx
+    cdef long top = gauge_y, bottom = gauge_y, left = gauge_x, right = gauge_x
+    cdef char[:,:] mask
 
     stck.push(index(gauge_y, gauge_x))
     while (not stck.empty()):
         idx = stck.top()
         stck.pop()
-        mask[idx.first, idx.second] = 1
+        top = min(top, idx.first)
+        bottom = max(bottom, idx.first)
+        left = min(left, idx.second)
+        right = max(right, idx.second)
         upstreamCells(fdir, stck, idx)
 
-    return mask
+    mask = np.zeros((bottom - top + 1, right - left + 1), dtype=np.int8)
+    stck.push(index(gauge_y, gauge_x))
+    while (not stck.empty()):
+        idx = stck.top()
+        stck.pop()
+        mask[idx.first - top, idx.second - left] = 1
+        upstreamCells(fdir, stck, idx)
+
+    return mask, top, left
 
 @cython.boundscheck(False)
-cdef void upstreamCells(int[:, :]& fdir, stack[index]& stack, index& idx):
+cdef void upstreamCells(const int[:, :]& fdir, stack[index]& stack, index& idx):
     cdef int nrows = fdir.shape[0]
     cdef int ncols = fdir.shape[1]
     cdef long ynn, xnn
@@ -47,3 +63,34 @@ cdef void upstreamCells(int[:, :]& fdir, stack[index]& stack, index& idx):
 
 
 
+
+
+cpdef int[:,:] labelBasins(const int[:,:] fdir, long[:] gauge_y, long[:] gauge_x, int[:] gauge_ids, int fill_value):
+    # Label every cell with the id of its nearest downstream gauge. The basins
+    # are traced upstream from all gauges at once, the tracing stops at other
+    # gauges, so every cell is visited at most once. fdir is only read.
+    cdef int[:,:] labels = np.full(
+        (fdir.shape[0], fdir.shape[1]), fill_value, dtype=np.int32
+    )
+    cdef stack[index] stck
+    cdef stack[index] upstream
+    cdef index idx, nn
+    cdef long i
+
+    for i in range(gauge_y.shape[0]):
+        labels[gauge_y[i], gauge_x[i]] = gauge_ids[i]
+
+    for i in range(gauge_y.shape[0]):
+        stck.push(index(gauge_y[i], gauge_x[i]))
+        while (not stck.empty()):
+            idx = stck.top()
+            stck.pop()
+            upstreamCells(fdir, upstream, idx)
+            while (not upstream.empty()):
+                nn = upstream.top()
+                upstream.pop()
+                if labels[nn.first, nn.second] == fill_value:
+                    labels[nn.first, nn.second] = labels[idx.first, idx.second]
+                    stck.push(nn)
+
+    return labels
@@ -75,7 +75,8 @@ def matchFlowacc(gauge, facc, max_distance, max_error, scaling_factor=1):
         "xmin": x - max_distance,
         "xmax": x + max_distance,
     }
-    grid = facc.shrink(**bbox).astype("float32")
+    # cell counts, the same for int32 and other dtypes (e.g. virtual memory)
+    grid = facc.shrink(**bbox).astype(np.int32).astype("float32")
     grid *= abs(
         (grid.cellsize[0] * scaling_factor) * (grid.cellsize[1] * scaling_factor)
     )
@@ -100,3 +101,69 @@ def matchFlowacc(gauge, facc, max_distance, max_error, scaling_factor=1):
         # the cell cordinates
         y, x = grid.coordinatesOf(river_cells_y[nn], river_cells_x[nn])
         return Gauge(id=gauge.id, y=y, x=x, size=size)
+
+
+def hilbertIndex(y, x, bits=16):
+    """
+    Arguments
+    ---------
+    y, x : array of int  # cell coordinates in [0, 2**bits)
+    bits : int           # order of the curve
+
+    Returns
+    -------
+    array of int
+
+    Purpose
+    -------
+    Distance of the given cells along a Hilbert curve, i.e. cells close
+    to each other on the curve are close to each other in space.
+    """
+    y = np.array(y, dtype=np.int64, copy=True)
+    x = np.array(x, dtype=np.int64, copy=True)
+    out = np.zeros(np.shape(x), dtype=np.int64)
+    s = 2 ** (bits - 1)
+    while s > 0:
+        ry = (y & s) > 0
+        rx = (x & s) > 0
+        out += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant
+        rotate = ~ry
+        flip = rotate & rx
+        x[flip] = s - 1 - x[flip]
+        y[flip] = s - 1 - y[flip]
+        x[rotate], y[rotate] = y[rotate], x[rotate]
+        s //= 2
+    return out
+
+
+def hilbertOrder(gauges, bits=16):
+    """
+    Arguments
+    ---------
+    gauges : list of Gauge
+    bits   : int  # resolution of the curve, see hilbertIndex
+
+    Returns
+    -------
+    list of Gauge
+
+    Purpose
+    -------
+    Sort the gauges along a Hilbert curve over their locations, so that
+    consecutive gauges are neighbours and read overlapping windows of the
+    input data. Gauges without a location (i.e. given as a mask file)
+    are appended in their input order.
+    """
+    located = [g for g in gauges if not g.path and g.y is not None]
+    others = [g for g in gauges if g.path or g.y is None]
+    if len(located) < 2:
+        return located + others
+
+    coords = np.array([(float(g.y), float(g.x)) for g in located])
+    lower, upper = coords.min(axis=0), coords.max(axis=0)
+    extent = np.where(upper > lower, upper - lower, 1)
+    cells = ((coords - lower) / extent * (2**bits - 1)).astype(np.int64)
+    # y grows upwards, the curve starts in the upper left corner
+    index = hilbertIndex(2**bits - 1 - cells[:, 0], cells[:, 1], bits)
+    return [located[i] for i in np.argsort(index, kind="stable")] + others
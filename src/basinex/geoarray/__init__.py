@@ -2,6 +2,7 @@
 
 from .gdalfuncs import project, resample, rescale
 from .gdalio import _DRIVER_DICT  # fromfile,
+from .tiles import Prefetcher, TileCache, windowed
 from .wrapper import (
     array,
     empty,
@@ -9,6 +10,7 @@ from .wrapper import (
     fromfile,
     full,
     full_like,
+    nbytes,
     ones,
     ones_like,
     zeros,
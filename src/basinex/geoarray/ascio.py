@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Native reader and writer for ArcASCII (AAIGrid) grids. The header is
+parsed line by line, the body is converted/formatted in bulk with
+numpy, which is considerably faster than GDAL's row-wise AAIGrid driver.
+Files that need features beyond the plain format (i.e. projection
+sidecar files, multiple bands, rotated grids, creation options)
+are left to GDAL.
+"""
+
+import os
+
+import numpy as np
+
+from .geotrans import _Geotrans
+
+_EXTENSIONS = (".asc",)
+
+# all keys, that might appear in the header
+_HEADER_KEYS = (
+    b"ncols",
+    b"nrows",
+    b"xllcorner",
+    b"xllcenter",
+    b"yllcorner",
+    b"yllcenter",
+    b"cellsize",
+    b"dx",
+    b"dy",
+    b"nodata_value",
+)
+
+# characters indicating a floating point body (same heuristic as GDAL)
+_FLOAT_CHARS = (b".", b",", b"e", b"E", b"n", b"N")
+
+# approximate number of values to format at once
+_BLOCKSIZE = 2**17
+
+
+def _isAscii(fname):
+    return os.path.splitext(fname)[-1].lower() in _EXTENSIONS
+
+
+def _prjFile(fname):
+    return os.path.splitext(fname)[0] + ".prj"
+
+
+def _readable(fname, mode="r"):
+    """
+    Purpose
+    -------
+    Check if the given file can be read natively, i.e. it is an ArcASCII
+    grid without a projection file opened in read-only mode.
+    """
+    return mode == "r" and _isAscii(fname) and not os.path.exists(_prjFile(fname))
+
+
+def _writable(grid, fname, options=None):
+    """
+    Purpose
+    -------
+    Check if the given grid can be written natively to fname.
+    """
+    geotrans = grid.geotrans
+    return (
+        _isAscii(fname)
+        and not options
+        and grid.ndim == 2
+        and isinstance(geotrans, _Geotrans)
+        and geotrans.yparam == 0
+        and geotrans.xparam == 0
+        and not (grid.proj is not None and grid.proj.toWkt())
+    )
+
+
+def _readHeader(fobj):
+    header = {}
+    while True:
+        pos = fobj.tell()
+        parts = fobj.readline().split()
+        if len(parts) != 2 or parts[0].lower() not in _HEADER_KEYS:
+            fobj.seek(pos)
+            return header
+        header[parts[0].lower().decode()] = parts[1]
+
+
+def _asciiBytes(fname, dtype=None):
+    """
+    Purpose
+    -------
+    Estimated memory needed by _fromAscii: the text body and the decoded
+    data (32 bit, or cast to dtype) together with its mask.
+    """
+    with open(fname, "rb") as fobj:
+        header = _readHeader(fobj)
+    try:
+        ncells = int(header["nrows"]) * int(header["ncols"])
+    except (KeyError, ValueError):
+        raise IOError("Invalid ArcASCII header in file: {:}".format(fname))
+    size = 4 if dtype is None else np.dtype(dtype).itemsize
+    return os.path.getsize(fname) + ncells * (size + 1)
+
+
+def _fromAscii(fname):
+    """
+    Arguments
+    ---------
+    fname : str  # file name
+
+    Returns
+    -------
+    GeoArray
+
+    Purpose
+    -------
+    Read an ArcASCII grid into a GeoArray
+    """
+
+    from .core import GeoArray
+
+    with open(fname, "rb") as fobj:
+        header = _readHeader(fobj)
+        body = fobj.read()
+
+    try:
+        nrows, ncols = int(header["nrows"]), int(header["ncols"])
+        if "cellsize" in header:
+            ycellsize = xcellsize = float(header["cellsize"])
+        else:
+            ycellsize, xcellsize = float(header["dy"]), float(header["dx"])
+        xll = float(header.get("xllcorner", header.get("xllcenter")))
+        yll = float(header.get("yllcorner", header.get("yllcenter")))
+    except (KeyError, TypeError, ValueError):
+        raise IOError("Invalid ArcASCII header in file: {:}".format(fname))
+
+    if "xllcenter" in header:
+        xll -= xcellsize / 2.0
+    if "yllcenter" in header:
+        yll -= ycellsize / 2.0
+
+    nodata = header.get("nodata_value")
+    isfloat = any(c in body or c in (nodata or b"") for c in _FLOAT_CHARS)
+    data = np.fromstring(body, dtype=np.float32 if isfloat else np.int32, sep=" ")
+
+    if data.size != nrows * ncols:
+        raise IOError(
+            "Expected {:} values, found {:} in file: {:}".format(
+                nrows * ncols, data.size, fname
+            )
+        )
+    data = data.reshape(nrows, ncols)
+
+    geotrans = _Geotrans(
+        yorigin=yll + nrows * ycellsize,
+        xorigin=xll,
+        ycellsize=-ycellsize,
+        xcellsize=xcellsize,
+        yparam=0,
+        xparam=0,
+        origin="ul",
+        shape=data.shape,
+    )
+
+    return GeoArray(
+        data=data,
+        fill_value=None if nodata is None else float(nodata),
+        mode="r",
+        color_mode="L",
+        geotrans=geotrans,
+    )
+
+
+def _toAscii(grid, fname):
+    """
+    Arguments
+    ---------
+    grid  : GeoArray
+    fname : str  # file name
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Write a 2D GeoArray to an ArcASCII grid. The layout follows the
+    one of GDAL's AAIGrid driver.
+    """
+
+    data = np.asarray(grid.data)
+    isint = data.dtype.kind in "biu"
+    valfmt = " %d" if isint else (" %.17g" if data.dtype.itemsize > 4 else " %.9g")
+
+    bbox = grid.bbox
+    ycellsize, xcellsize = (abs(c) for c in grid.cellsize)
+    header = [
+        "ncols        {:d}".format(grid.ncols),
+        "nrows        {:d}".format(grid.nrows),
+        "xllcorner    {:.12f}".format(bbox["xmin"]),
+        "yllcorner    {:.12f}".format(bbox["ymin"]),
+    ]
+    if abs(ycellsize - xcellsize) > 1e-10:
+        header.append("dx           {:.12f}".format(xcellsize))
+        header.append("dy           {:.12f}".format(ycellsize))
+    else:
+        header.append("cellsize     {:.12f}".format(xcellsize))
+
+    fill_value = grid.fill_value
+    if fill_value is not None:
+        if isint:
+            nodata = "{:d}".format(int(fill_value))
+        else:
+            # keep a decimal point, so that the grid is read as float again
+            nodata = repr(float(fill_value))
+        header.append("NODATA_value {:}".format(nodata))
+
+    # the flip ensures, that the first line is the northernmost one
+    if grid.ycellsize > 0:
+        data = data[::-1]
+    if grid.xcellsize < 0:
+        data = data[:, ::-1]
+
+    nrows = max(1, _BLOCKSIZE // max(grid.ncols, 1))
+    rowfmt = valfmt * grid.ncols + "\n"
+    with open(fname, "w") as fobj:
+        fobj.write("\n".join(header) + "\n")
+        for row in range(0, grid.nrows, nrows):
+            block = data[row : row + nrows]
+            fobj.write((rowfmt * len(block)) % tuple(block.ravel().tolist()))
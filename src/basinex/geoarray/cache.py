@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+An opt-in binary cache for text rasters. The decoded data is stored as
+a memory-mappable .npy file and the georeferencing in a JSON sidecar.
+Cache entries are keyed by the absolute path of the source file and
+validated by its size, modification time and content hash.
+"""
+
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from .ascio import _isAscii
+from .geotrans import _Geotrans
+
+
+def _cacheable(fname, mode="r"):
+    return mode == "r" and _isAscii(fname)
+
+
+def _cacheNames(fname, cachedir):
+    key = hashlib.sha1(os.path.abspath(fname).encode("utf-8")).hexdigest()
+    base = os.path.join(cachedir, key)
+    return base + ".npy", base + ".json"
+
+
+def _fileStat(fname):
+    stat = os.stat(fname)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def _fileHash(fname, blocksize=2**20):
+    out = hashlib.blake2b()
+    with open(fname, "rb") as f:
+        for block in iter(lambda: f.read(blocksize), b""):
+            out.update(block)
+    return out.hexdigest()
+
+
+def _dumpJson(meta, fname):
+    # write to a temporary file first, other processes might read the cache
+    tmpname = "{:}.{:}".format(fname, uuid.uuid4().hex)
+    with open(tmpname, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmpname, fname)
+
+
+def _fromCache(fname, cachedir):
+    """
+    Arguments
+    ---------
+    fname    : str  # file name of the source raster
+    cachedir : str  # cache directory
+
+    Returns
+    -------
+    GeoArray or None
+
+    Purpose
+    -------
+    Return the cached version of fname as a GeoArray backed by a
+    copy-on-write memory map or None if there is no valid cache entry.
+    """
+
+    from .core import GeoArray
+
+    npyname, jsonname = _cacheNames(fname, cachedir)
+    try:
+        with open(jsonname, "r") as f:
+            meta = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    stat = _fileStat(fname)
+    if meta["source"]["size"] != stat["size"]:
+        return None
+    if meta["source"]["mtime"] != stat["mtime"]:
+        # the file might only have been touched/copied
+        if meta["source"]["hash"] != _fileHash(fname):
+            return None
+        meta["source"].update(stat)
+        _dumpJson(meta, jsonname)
+
+    try:
+        data = np.load(npyname, mmap_mode="c")
+    except (IOError, ValueError):
+        return None
+
+    return GeoArray(
+        data=data,
+        geotrans=_Geotrans(shape=data.shape, **meta["geotrans"]),
+        fill_value=meta["fill_value"],
+        proj=meta["proj"] or None,
+        mode="r",
+        color_mode=meta["color_mode"],
+    )
+
+
+def _toCache(grid, fname, cachedir):
+    """
+    Arguments
+    ---------
+    grid     : GeoArray  # decoded content of fname
+    fname    : str       # file name of the source raster
+    cachedir : str       # cache directory
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Store the given grid as the cache entry of fname.
+    """
+
+    if not isinstance(grid.geotrans, _Geotrans):
+        return
+
+    if not os.path.isdir(cachedir):
+        os.makedirs(cachedir, exist_ok=True)
+
+    npyname, jsonname = _cacheNames(fname, cachedir)
+
+    tmpname = "{:}.{:}.npy".format(npyname, uuid.uuid4().hex)
+    np.save(tmpname, np.asarray(grid.data))
+    os.replace(tmpname, npyname)
+
+    source = _fileStat(fname)
+    source["hash"] = _fileHash(fname)
+    geotrans = {
+        k: v if k == "origin" else float(v) for k, v in grid.geotrans._todict().items()
+    }
+    meta = {
+        "source": source,
+        "geotrans": geotrans,
+        "fill_value": None if grid.fill_value is None else float(grid.fill_value),
+        "proj": grid.proj.toWkt() if grid.proj is not None else None,
+        "color_mode": grid.color_mode,
+    }
+    _dumpJson(meta, jsonname)
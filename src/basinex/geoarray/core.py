@@ -131,24 +131,29 @@ class GeoArray(SpatialMixin, MaskedArray):
         proj=None,
         fill_value=None,
         fobj=None,
-        color_mode=None,  # mask=None,
+        color_mode=None,
         yvalues=None,
         xvalues=None,
         mode="r",
+        mask=None,
         *args,
         **kwargs,
     ):
 
-        # NOTE: The mask will always be calculated, even if its
-        #       already present or not needed at all...
-        mask = (
-            np.zeros_like(data, np.bool) if fill_value is None else data == fill_value
-        )
+        # NOTE: The mask will be calculated, unless given explicitly
+        #       (e.g. nomask for data mapped into virtual memory)
+        if mask is None:
+            mask = (
+                np.zeros_like(data, np.bool)
+                if fill_value is None
+                else data == fill_value
+            )
 
         self = MaskedArray.__new__(
             cls, data=data, fill_value=fill_value, mask=mask, *args, **kwargs
         )
-        self.unshare_mask()
+        if mask is not np.ma.nomask:
+            self.unshare_mask()
 
         self.__dict__["geotrans"] = geotrans
         self.__dict__["proj"] = _Projection(proj)
@@ -323,8 +328,8 @@ class GeoArray(SpatialMixin, MaskedArray):
         self.flush()
         self._fobj = None
 
-    def tofile(self, fname):
-        _toFile(self, fname)
+    def tofile(self, fname, options=None):
+        _toFile(self, fname, options=options)
 
     def setMask(self, mask):
         from .wrapper import array
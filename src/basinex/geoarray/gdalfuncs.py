@@ -11,6 +11,7 @@ except ImportError:
 
 from .gdalio import _fromDataset, _getDataset
 from .gdalspatial import _Projection, _Transformer
+from .geotrans import _Geotrans
 from .wrapper import array, full
 
 gdal.UseExceptions()
@@ -31,6 +32,9 @@ _RESAMPLING = {
     "min": getattr(gdal, "GRA_Min", None),
 }
 
+# resampling methods, rescale can compute with numpy
+_BLOCK_FUNCS = ("average", "max", "min")
+
 
 def _warpTo(source, target, func, max_error=0.125):
 
@@ -124,7 +128,82 @@ def resample(source, target, func="nearest", max_error=0.125):
     return _warpTo(source=source, target=target, func=func, max_error=max_error)
 
 
+def _blockReduce(source, scaling_factor, func):
+    """
+    Arguments
+    ---------
+    source         : GeoArray
+    scaling_factor : scalar
+    func           : str  # resampling method
+
+    Returns
+    -------
+    GeoArray or None
+
+    Purpose
+    -------
+    Rescale the source grid by reducing blocks of scaling_factor x
+    scaling_factor cells with numpy. The target grid of rescale is
+    anchored at the source origin, so every target cell covers exactly
+    one block of source cells, if the scaling factor is an integer.
+    Fill values are ignored, cells without any valid source value are
+    set to the fill value (i.e. the same as GDAL's Warp does).
+    None is returned, if the fast path is not applicable.
+    """
+
+    factor = int(round(scaling_factor))
+    if (
+        func not in _BLOCK_FUNCS
+        or factor < 1
+        or abs(scaling_factor - factor) > 1e-6 * factor
+        or not isinstance(source.geotrans, _Geotrans)
+        or source.yparam != 0
+        or source.xparam != 0
+        or (func == "average" and source.dtype.kind not in "fc")
+    ):
+        return None
+
+    # cells not covered by a complete target cell are not considered
+    nrows, ncols = source.nrows // factor, source.ncols // factor
+    if nrows == 0 or ncols == 0:
+        return None
+    crop = (Ellipsis, slice(0, nrows * factor), slice(0, ncols * factor))
+
+    shape = source.shape[:-2] + (nrows, factor, ncols, factor)
+    data = np.asarray(source.data)[crop].reshape(shape)
+    valid = ~np.ma.getmaskarray(source)[crop].reshape(shape)
+    count = valid.sum(axis=-1).sum(axis=-2)
+
+    if func == "average":
+        values = np.where(valid, data, 0).sum(axis=-1).sum(axis=-2)
+        values = values / np.maximum(count, 1)
+    else:
+        blocks = np.ma.array(data, mask=~valid)
+        reduce = getattr(np.ma, func)
+        values = np.ma.getdata(reduce(reduce(blocks, axis=-1), axis=-2))
+
+    fill_value = source.fill_value
+    if fill_value is not None:
+        values = np.where(count > 0, values, fill_value)
+
+    return array(
+        data=values.astype(source.dtype),
+        yorigin=source.yorigin,
+        xorigin=source.xorigin,
+        origin=source.origin,
+        cellsize=tuple(c * factor for c in source.cellsize),
+        proj=source.proj,
+        fill_value=fill_value,
+        mode=source.mode,
+    )
+
+
 def rescale(source, scaling_factor, func="nearest"):
+    # integer scaling factors are handled without a GDAL round trip
+    out = _blockReduce(source, scaling_factor, func)
+    if out is not None:
+        return out
+
     shape = list(source.shape[:-2]) + [
         int(s / scaling_factor) for s in source.shape[-2:]
     ]
@@ -10,8 +10,10 @@ try:
 except ImportError:
     import gdal, osr
 
+from .ascio import _asciiBytes, _fromAscii, _readable, _toAscii, _writable
 from .gdalspatial import _Projection
 from .geotrans import _Geotrans
+from .utils import _tupelize
 
 gdal.UseExceptions()
 gdal.PushErrorHandler("CPLQuietErrorHandler")
@@ -96,12 +98,40 @@ def _fromFile(fname, mode="r"):
             "Supported file modes are: {:}".format(", ".join(_FILE_MODE_DICT.keys()))
         )
 
+    if _readable(fname, mode):
+        return _fromAscii(fname)
+
     fobj = gdal.OpenShared(fname, _FILE_MODE_DICT[mode])
     if fobj:
         return _fromDataset(fobj, mode)
     raise IOError("Could not open file: {:}".format(fname))
 
 
+def _fileBytes(fname, mode="r", dtype=None):
+    """
+    Purpose
+    -------
+    Estimated memory needed to read the given file with _fromFile, i.e.
+    the data of all bands (cast to dtype, if given) and the mask, without
+    reading the data.
+    """
+    if _readable(fname, mode):
+        return _asciiBytes(fname, dtype)
+
+    fobj = gdal.OpenShared(fname, _FILE_MODE_DICT[mode])
+    if not fobj:
+        raise IOError("Could not open file: {:}".format(fname))
+    ncells = fobj.RasterYSize * fobj.RasterXSize
+    out = ncells
+    for i in range(fobj.RasterCount):
+        if dtype is None:
+            size = gdal.GetDataTypeSize(fobj.GetRasterBand(i + 1).DataType) // 8
+        else:
+            size = np.dtype(dtype).itemsize
+        out += ncells * size
+    return out
+
+
 def _getColorMode(fobj):
     tmp = []
     for i in range(fobj.RasterCount):
@@ -110,9 +140,13 @@ def _getColorMode(fobj):
     return "".join(sorted(set(tmp), key=tmp.index))
 
 
-def _fromDataset(fobj, mode="r"):
-
-    from .core import GeoArray
+def _datasetArgs(fobj):
+    """
+    Purpose
+    -------
+    Everything but the data needed to create a GeoArray from the given
+    GDAL dataset, i.e. the data can be read in windows.
+    """
 
     def _parseGeotrans(geotrans):
         return {
@@ -137,19 +171,39 @@ def _fromDataset(fobj, mode="r"):
             RuntimeWarning,
         )
 
-    data = fobj.GetVirtualMemArray() if mode == "v" else fobj.ReadAsArray()
+    shape = (fobj.RasterYSize, fobj.RasterXSize)
+    if fobj.RasterCount > 1:
+        shape = (fobj.RasterCount,) + shape
+
     # NOTE: not to robust...
-    geotrans = _Geotrans(shape=data.shape, **_parseGeotrans(fobj.GetGeoTransform()))
-
-    return GeoArray(
-        data=data,
-        fill_value=fill_values[0],
-        proj=_Projection(fobj.GetProjection()),
-        mode=mode,
-        color_mode=_getColorMode(fobj),
-        fobj=fobj,
-        geotrans=geotrans,
-    )
+    geotrans = _Geotrans(shape=shape, **_parseGeotrans(fobj.GetGeoTransform()))
+
+    return {
+        "fill_value": fill_values[0],
+        "proj": _Projection(fobj.GetProjection()),
+        "color_mode": _getColorMode(fobj),
+        "geotrans": geotrans,
+    }
+
+
+def _fromDataset(fobj, mode="r"):
+
+    from .core import GeoArray
+
+    if mode == "v":
+        # the mask would page in the whole mapping, windows (see
+        # GeoArray.__getitem__) compute their own
+        return GeoArray(
+            data=fobj.GetVirtualMemArray(),
+            mode=mode,
+            fobj=fobj,
+            mask=np.ma.nomask,
+            **_datasetArgs(fobj),
+        )
+
+    data = fobj.ReadAsArray()
+
+    return GeoArray(data=data, mode=mode, fobj=fobj, **_datasetArgs(fobj))
 
 
 def _getDataset(grid, mem=False):
@@ -184,11 +238,81 @@ def _getDataset(grid, mem=False):
     return out
 
 
-def _toFile(geoarray, fname):
+def _creationOptions(options):
     """
     Arguments
     ---------
-    fname : str  # file name
+    options : dict/list/str/None  # driver specific creation options
+
+    Returns
+    -------
+    list of str
+
+    Purpose
+    -------
+    Convert the given creation options into the list of "KEY=VALUE"
+    strings expected by GDAL. Options can be given as a dictionary
+    (e.g. {"COMPRESS": "DEFLATE", "TILED": True}) or as "KEY=VALUE"
+    string(s). Booleans are translated to "YES"/"NO", as YAML parsers
+    tend to convert these values.
+    """
+    if not options:
+        return []
+    if isinstance(options, dict):
+        out = []
+        for key, value in options.items():
+            if isinstance(value, bool):
+                value = "YES" if value else "NO"
+            out.append("{:}={:}".format(str(key).upper(), value))
+        return out
+    return [str(opt) for opt in _tupelize(options)]
+
+
+def _createFile(grid, driver, fname, options):
+    """
+    Create the dataset fname directly on disk and write the given grid
+    band by band and block by block, i.e. without an in-memory copy.
+    """
+    try:
+        dtype = _TYPEMAP[str(grid.dtype)]
+    except KeyError:
+        raise RuntimeError("Datatype {:} not supported by GDAL".format(grid.dtype))
+
+    out = driver.Create(
+        fname, grid.ncols, grid.nrows, grid.nbands, dtype, options=options
+    )
+    if out is None:
+        raise IOError("Could not create file: {:}".format(fname))
+
+    if isinstance(grid.geotrans, _Geotrans):
+        out.SetGeoTransform(grid.toGdal())
+
+    if grid.proj:
+        out.SetProjection(grid.proj.toWkt())
+
+    data = np.asarray(grid.data)
+    if data.ndim == 2:
+        data = data[None, ...]
+
+    for n in range(grid.nbands):
+        band = out.GetRasterBand(n + 1)
+        if grid.fill_value is not None:
+            band.SetNoDataValue(float(grid.fill_value))
+        # write full width stripes, spanning one row of blocks each
+        yblock = max(band.GetBlockSize()[1], 1)
+        for row in range(0, grid.nrows, yblock):
+            band.WriteArray(data[n, row : row + yblock], 0, row)
+
+    out.FlushCache()
+
+
+def _toFile(geoarray, fname, options=None):
+    """
+    Arguments
+    ---------
+    fname   : str                 # file name
+    options : dict/list/None      # driver specific creation options,
+                                  # e.g. {"COMPRESS": "DEFLATE", "TILED": "YES"}
 
     Returns
     -------
@@ -198,6 +322,9 @@ def _toFile(geoarray, fname):
     -------
     Write GeoArray to file. The output dataset type is derived from
     the file name extension. See _DRIVER_DICT for implemented formats.
+    Plain ArcASCII grids are written natively (see ascio). Otherwise
+    the dataset is created directly on disk, if the driver supports it,
+    or an in-memory copy is written (e.g. AAIGrid with options).
     """
 
     def _fnameExtension(fname):
@@ -222,9 +349,18 @@ def _toFile(geoarray, fname):
         otype = max(tdict, key=lambda x: x[0])[-1]
         return np.dtype(_TYPEMAP[otype])
 
-    dataset = _getDataset(geoarray)
+    if _writable(geoarray, fname, options):
+        _toAscii(geoarray, fname)
+        return
+
     driver = _getDriver(_fnameExtension(fname))
-    driver.CreateCopy(fname, dataset, 0)
+    options = _creationOptions(options)
+
+    if driver.GetMetadata_Dict().get("DCAP_CREATE") == "YES":
+        _createFile(geoarray, driver, fname, options)
+    else:
+        dataset = _getDataset(geoarray)
+        driver.CreateCopy(fname, dataset, 0, options=options)
 
 
 def _writeData(grid):
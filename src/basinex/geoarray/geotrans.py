@@ -254,6 +254,18 @@ class _Geotrans(_GeoBase):
         xvalues = np.array(
             _broadcastTo(self.xvalues, self.shape, (-2, -1))[slc], copy=False, ndmin=2
         )
+        return self._fromCoordinates(yvalues, xvalues)
+
+    def _window(self, top, left, nrows, ncols):
+        # the same as _getitem for the slice [top:top+nrows, left:left+ncols],
+        # but only the coordinates of the window are computed
+        xdata, ydata = np.meshgrid(
+            np.arange(left, left + ncols, dtype=float),
+            np.arange(top, top + nrows, dtype=float),
+        )
+        return self._fromCoordinates(*self._calcCoordinate(ydata, xdata))
+
+    def _fromCoordinates(self, yvalues, xvalues):
 
         nrows, ncols = yvalues.shape[-2:]
         ycellsize = np.diff(yvalues, axis=-2).mean() if nrows > 1 else self.ycellsize
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+A least recently used (LRU) cache of decoded raster tiles, bounded by its
+size in MB. Windows of a raster (see TileCache.read) are assembled from
+square tiles, which are read only once and then served from memory to
+all overlapping windows (e.g. of neighbouring basins).
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import floor
+
+import numpy as np
+
+from .ascio import _readable
+from .cache import _cacheable
+from .gdalio import _FILE_MODE_DICT, _datasetArgs, _fromFile, gdal
+from .wrapper import fromfile
+
+# edge length of the tiles [cells]
+TILE_SIZE = 256
+
+
+def windowed(fname, cache=None):
+    """
+    Arguments
+    ---------
+    fname : str       # file name
+    cache : str/None  # cache directory for text rasters, see fromfile
+
+    Returns
+    -------
+    bool
+
+    Purpose
+    -------
+    Check if windows of the given file are read without decoding the
+    whole raster, i.e. it is read by GDAL or from the memory-mapped
+    binary copy of a text raster. Other text rasters are decoded once
+    and kept in memory by the TileCache.
+    """
+    return not _readable(fname) or bool(cache and _cacheable(fname))
+
+
+class _Source(object):
+    # the header of a raster and a reader for its tiles
+    def __init__(self, fname, cache=None):
+        self.fname = fname
+        self.cache = cache
+        self.grid = None
+        # GDAL datasets are not shared between threads
+        self._local = threading.local()
+        if (cache and _cacheable(fname)) or _readable(fname):
+            # text rasters can't be read in windows, they are decoded only
+            # once and served from memory (or the memory-mapped binary copy)
+            if cache and _cacheable(fname):
+                self.grid = fromfile(fname, cache=cache)
+            else:
+                self.grid = _fromFile(fname)
+            args = self.grid._getArgs()
+            for key in ("data", "fobj", "mode"):
+                args.pop(key, None)
+        else:
+            args = _datasetArgs(self._open())
+        self.args = args
+
+    def _open(self):
+        # one dataset per thread, kept open for all tiles
+        fobj = getattr(self._local, "fobj", None)
+        if fobj is None:
+            fobj = gdal.Open(self.fname, _FILE_MODE_DICT["r"])
+            if not fobj:
+                raise IOError("Could not open file: {:}".format(self.fname))
+            self._local.fobj = fobj
+        return fobj
+
+    @property
+    def geotrans(self):
+        return self.args["geotrans"]
+
+    @property
+    def shape(self):
+        return self.geotrans.shape
+
+    def window(self, ymin=None, ymax=None, xmin=None, xmax=None):
+        # top, left, bottom, right cell of the bbox, see shrink
+        nrows, ncols = self.shape[-2:]
+        full = self.geotrans.bbox
+        cellsize = [float(abs(cs)) for cs in self.geotrans.cellsize]
+        top = floor(
+            (full["ymax"] - (full["ymax"] if ymax is None else ymax)) / cellsize[0]
+        )
+        left = floor(
+            ((full["xmin"] if xmin is None else xmin) - full["xmin"]) / cellsize[1]
+        )
+        bottom = floor(
+            ((full["ymin"] if ymin is None else ymin) - full["ymin"]) / cellsize[0]
+        )
+        right = floor(
+            (full["xmax"] - (full["xmax"] if xmax is None else xmax)) / cellsize[1]
+        )
+        return (
+            max(top, 0),
+            max(left, 0),
+            nrows - max(bottom, 0),
+            ncols - max(right, 0),
+        )
+
+    def read(self, top, left, nrows, ncols):
+        if self.grid is not None:
+            return np.array(self.grid.data[..., top : top + nrows, left : left + ncols])
+        return self._open().ReadAsArray(left, top, ncols, nrows)
+
+
+class TileCache(object):
+    """
+    Arguments
+    ---------
+    max_mb    : scalar    # maximum size of the cached tiles in MB
+    tile_size : int       # edge length of the tiles in cells
+    cache     : str/None  # cache directory for text rasters, see fromfile
+    fnames    : list/None # files read through the cache, None for all
+
+    Purpose
+    -------
+    A thread-safe LRU cache of raster tiles, shared by all reads. The
+    number of tiles served from memory (hits), read from the files (misses)
+    and read ahead of their use (prefetched, see prefetch) is counted.
+    Text rasters, which are not cached as binary copies, are decoded once
+    and kept in memory in full (see windowed).
+    """
+
+    def __init__(self, max_mb=256, tile_size=TILE_SIZE, cache=None, fnames=None):
+        self.max_bytes = int(float(max_mb) * 2**20)
+        self.tile_size = int(tile_size)
+        self.cache = cache
+        self.fnames = None if fnames is None else set(fnames)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self._tiles = OrderedDict()
+        self._sources = {}
+        self._lock = threading.RLock()
+
+    def __contains__(self, fname):
+        return self.fnames is None or fname in self.fnames
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / float(total) if total else 0.0
+
+    def _source(self, fname):
+        with self._lock:
+            if fname not in self._sources:
+                self._sources[fname] = _Source(fname, self.cache)
+            return self._sources[fname]
+
+    def _insert(self, key, data):
+        with self._lock:
+            if key in self._tiles:
+                return
+            self._tiles[key] = data
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+                _, tile = self._tiles.popitem(last=False)
+                self.nbytes -= tile.nbytes
+
+    def _tile(self, source, ty, tx, prefetch=False):
+        key = (source.fname, ty, tx)
+        with self._lock:
+            tile = self._tiles.get(key)
+            if tile is not None:
+                self._tiles.move_to_end(key)
+                if not prefetch:
+                    self.hits += 1
+                return tile
+            if prefetch:
+                self.prefetched += 1
+            else:
+                self.misses += 1
+
+        # tiles at the lower and right border are clipped
+        size = self.tile_size
+        nrows, ncols = source.shape[-2:]
+        top, left = ty * size, tx * size
+        tile = source.read(top, left, min(size, nrows - top), min(size, ncols - left))
+        self._insert(key, tile)
+        return tile
+
+    def read(self, fname, ymin=None, ymax=None, xmin=None, xmax=None):
+        """
+        Arguments
+        ---------
+        fname                  : str     # file name
+        ymin, ymax, xmin, xmax : scalar  # bounding box
+
+        Returns
+        -------
+        GeoArray
+
+        Purpose
+        -------
+        Read the window of the given file covering the bbox, i.e. the same
+        as fromfile(fname).shrink(ymin, ymax, xmin, xmax).
+        """
+        from .core import GeoArray
+
+        source = self._source(fname)
+        top, left, bottom, right = source.window(ymin, ymax, xmin, xmax)
+
+        if bottom <= top or right <= left:
+            # outside of the grid, see shrink
+            return fromfile(fname, cache=self.cache).shrink(ymin, ymax, xmin, xmax)
+
+        size = self.tile_size
+        blocks = []
+        for ty in range(top // size, (bottom - 1) // size + 1):
+            row = []
+            for tx in range(left // size, (right - 1) // size + 1):
+                row.append(self._tile(source, ty, tx))
+            blocks.append(np.concatenate(row, axis=-1))
+        data = np.concatenate(blocks, axis=-2)
+
+        # cut the window from the tiles
+        y0, x0 = (top // size) * size, (left // size) * size
+        data = np.array(data[..., top - y0 : bottom - y0, left - x0 : right - x0])
+
+        args = dict(source.args)
+        args["geotrans"] = source.geotrans._window(
+            top, left, bottom - top, right - left
+        )
+        return GeoArray(data=data, mode="r", **args)
+
+    def prefetch(self, fname, ymin=None, ymax=None, xmin=None, xmax=None):
+        """
+        Arguments
+        ---------
+        fname                  : str     # file name
+        ymin, ymax, xmin, xmax : scalar  # bounding box
+
+        Returns
+        -------
+        None
+
+        Purpose
+        -------
+        Load the tiles covering the bbox into the cache, i.e. a following
+        read of the same window is served from memory.
+        """
+        source = self._source(fname)
+        top, left, bottom, right = source.window(ymin, ymax, xmin, xmax)
+        if bottom <= top or right <= left:
+            return
+        size = self.tile_size
+        for ty in range(top // size, (bottom - 1) // size + 1):
+            for tx in range(left // size, (right - 1) // size + 1):
+                self._tile(source, ty, tx, prefetch=True)
+
+
+class Prefetcher(object):
+    """
+    Arguments
+    ---------
+    tiles : TileCache
+    depth : int  # maximum number of pending prefetches
+
+    Purpose
+    -------
+    Load the windows of upcoming reads into the tile cache in a background
+    thread, while the current ones are processed. The memory is bounded by
+    the tile cache, the number of pending prefetches by depth.
+    """
+
+    def __init__(self, tiles, depth=1):
+        self.tiles = tiles
+        self.depth = max(int(depth), 1)
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prefetch")
+        self._pending = {}
+        self._submitted = set()
+        self._lock = threading.Lock()
+
+    def _load(self, reads):
+        for fname, bbox in reads:
+            try:
+                self.tiles.prefetch(fname, **bbox)
+            except Exception as exc:
+                # the error is raised again by the actual read
+                logging.debug("prefetching %s failed: %s", fname, exc)
+
+    def submit(self, key, reads):
+        """
+        Arguments
+        ---------
+        key   : hashable                    # e.g. the gauge id
+        reads : list of (str, dict) tuples  # file names and bboxes
+
+        Returns
+        -------
+        bool  # False, if the reads were already or could not be submitted
+
+        Purpose
+        -------
+        Prefetch the given windows, unless depth prefetches are pending.
+        """
+        with self._lock:
+            for done in [k for k, f in self._pending.items() if f.done()]:
+                del self._pending[done]
+            if key in self._submitted or len(self._pending) >= self.depth:
+                return False
+            self._submitted.add(key)
+            self._pending[key] = self._pool.submit(self._load, reads)
+            return True
+
+    def close(self):
+        with self._lock:
+            for future in self._pending.values():
+                future.cancel()
+            self._pending = {}
+        self._pool.shutdown()
@@ -12,8 +12,9 @@ This module provides initializer function for core.GeoArray
 
 import numpy as np
 
+from .cache import _cacheable, _fromCache, _toCache
 from .core import GeoArray
-from .gdalio import _fromDataset, _fromFile
+from .gdalio import _fileBytes, _fromDataset, _fromFile
 from .gdalspatial import _Projection
 from .geotrans import _Geolocation, _Geotrans
 from .utils import _tupelize
@@ -255,19 +256,55 @@ def fromdataset(ds):
     return array(**_fromDataset(ds))
 
 
-def fromfile(fname, mode="r"):
+def fromfile(fname, mode="r", cache=None):
     """
     Arguments
     ---------
     fname : str  # file name
 
+    Optional Arguments
+    ------------------
+    mode  : {"r", "v", "a"}, default: "r"  # file mode
+    cache : str/None, default: None        # cache directory for text rasters
+
     Returns
     -------
     GeoArray
 
     Purpose
     -------
-    Create GeoArray from file
+    Create GeoArray from file. If a cache directory is given, text
+    rasters (i.e. ArcASCII) are decoded only once and served from
+    a memory-mapped binary copy afterwards.
 
     """
+    if cache and _cacheable(fname, mode):
+        out = _fromCache(fname, cache)
+        if out is None:
+            out = _fromFile(fname, mode)
+            _toCache(out, fname, cache)
+        return out
     return _fromFile(fname, mode)
+
+
+def nbytes(fname, dtype=None):
+    """
+    Arguments
+    ---------
+    fname : str  # file name
+
+    Optional Arguments
+    ------------------
+    dtype : str/np.dtype/None, default: None  # e.g. of a following astype
+
+    Returns
+    -------
+    int
+
+    Purpose
+    -------
+    Estimated memory in bytes needed by fromfile(fname), i.e. data and
+    mask of the decoded raster. If dtype is given, the data is counted
+    as cast to it. Only the header of the file is read.
+    """
+    return _fileBytes(fname, dtype=dtype)
@@ -2,8 +2,13 @@
 
 import logging
 import os
+import shutil
+import sys
+import threading
+import time
 import warnings
 from argparse import ArgumentParser
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import numpy as np
@@ -11,10 +16,13 @@ import yaml
 
 from . import __version__
 from . import geoarray as ga
+from .archive import Archive, unpack
+from .drainage import GaugeTree, gaugeCells, writeLabels
 from .extractor import extract
-from .gauges import matchFlowacc, readGauges
-from .netcdf import NcDimDataset
+from .gauges import hilbertOrder, matchFlowacc, readGauges
+from .netcdf import _LOCK, NcDimDataset, NcDimWindow, _openLimit, writeWindows
 from .netcdf4 import NcDataset
+from .summary import Summary
 from .wrapper import GridFile, NcFile
 
 
@@ -29,6 +37,10 @@ def cli():
     os.chdir(Path(args.cwd))
     logging.debug(f"in directory: {os.getcwd()}")
 
+    if args.command == "unpack":
+        unpack(args.archives, args.outpath)
+        return
+
     config = readConfig(args.input)
 
     # command line option -n
@@ -41,6 +53,10 @@ def cli():
             raise ValueError("Given line number exceeds table row count")
         gauges = gauges[line : line + 1]
 
+    if args.command == "label":
+        writeLabels(config, gauges, args.output, args.threshold)
+        return
+
     main(config, gauges)
 
 
@@ -58,37 +74,166 @@ def readConfig(fname):
 def gaugeBasinMask(flowdir, gauge):
     gauge_idx = flowdir.indexOf(gauge.y, gauge.x)
 
-    mask = np.asarray(
-        extract(np.array(flowdir, dtype=np.int32, copy=True), *gauge_idx),
-        dtype=np.int32,
+    # flowdir is read in place (int32, see readGrid), only the window of
+    # the basin is allocated
+    mask, top, left = extract(flowdir.data, *gauge_idx)
+    mask = np.asarray(mask)
+    window = flowdir.removeCells(
+        top=top,
+        left=left,
+        bottom=flowdir.nrows - top - mask.shape[0],
+        right=flowdir.ncols - left - mask.shape[1],
     )
 
-    mask[mask == 0] = flowdir.fill_value
-    out = ga.array(mask, **flowdir.header)
-    return out.trim()
+    data = np.full(mask.shape, flowdir.fill_value, dtype=np.int32)
+    data[mask == 1] = 1
+    return ga.array(data, **window.header)
+
+
+def readMode(config, key, fname):
+    """
+    Arguments
+    ---------
+    config : dict  # content of the input file
+    key    : str   # 'flowacc', 'flowdir' or 'gridfiles'
+    fname  : str   # raster file
+
+    Returns
+    -------
+    str  # 'memory', 'virtual' or 'tiles'
+
+    Purpose
+    -------
+    Choose how to read the given raster within the 'memory_limit' (MB).
+    Rasters within the limit are read into memory, the flow grids as
+    int32. Larger flow grids are mapped into virtual memory by GDAL
+    (Linux only) and paged in on demand. The flow direction grid is read
+    in place by the delineation, so it needs to be stored as int32.
+    Larger gridfiles (all with a 'tile-cache') are read in tiles, unless
+    they are text rasters without 'cache', which are decoded in full.
+    """
+    limit = config.get("memory_limit")
+    if key == "gridfiles":
+        tiled = config.get("tile-cache") or config.get("prefetch")
+        if tiled or (limit and ga.nbytes(fname) > float(limit) * 2**20):
+            return "tiles" if ga.windowed(fname, config.get("cache")) else "memory"
+        return "memory"
+    if not limit or ga.nbytes(fname, np.int32) <= float(limit) * 2**20:
+        return "memory"
+    if not sys.platform.startswith("linux"):
+        if key == "flowdir":
+            raise ValueError(
+                "The flow direction grid {:} exceeds the memory_limit, "
+                "virtual memory is only supported on Linux".format(fname)
+            )
+        return "memory"
+    if key == "flowdir" and ga.fromfile(fname, mode="v").dtype != np.int32:
+        raise ValueError(
+            "The flow direction grid {:} exceeds the memory_limit, it needs to "
+            "be stored as int32 (e.g. gdal_translate -ot Int32)".format(fname)
+        )
+    return "virtual"
+
+
+def logReadModes(config):
+    # the read mode of every raster, see readMode
+    descriptions = {
+        "memory": "in memory",
+        "virtual": "GDAL virtual memory",
+        "tiles": "in tiles",
+    }
+    fnames = [(key, config[key]) for key in ("flowacc", "flowdir") if key in config]
+    fnames += [("gridfiles", fdict["fname"]) for fdict in config.get("gridfiles", [])]
+    limit = float(config["memory_limit"]) * 2**20
+    modes = {}
+    for key, fname in fnames:
+        modes[fname] = readMode(config, key, fname)
+        size = ga.nbytes(fname, None if key == "gridfiles" else np.int32)
+        logging.info(
+            "reading %s (%.1f MB): %s",
+            fname,
+            size / 2**20,
+            descriptions[modes[fname]],
+        )
+        if modes[fname] == "memory" and size > limit:
+            logging.warning("%s exceeds the memory_limit, but is read in full", fname)
+    return modes
+
+
+def readGrid(config, key):
+    """
+    Arguments
+    ---------
+    config : dict  # content of the input file
+    key    : str   # 'flowacc' or 'flowdir'
+
+    Returns
+    -------
+    GeoArray
+
+    Purpose
+    -------
+    Read the flow accumulation or flow direction grid as int32, see
+    readMode. A flow accumulation grid in virtual memory keeps its dtype,
+    its windows are cast when read (see matchFlowacc, gaugeGrid).
+    """
+    fname = config[key]
+    if readMode(config, key, fname) == "virtual":
+        # paged in on demand, neither copied nor masked in full
+        return ga.fromfile(fname, mode="v")
+    return ga.fromfile(fname, cache=config.get("cache")).astype(np.int32)
+
+
+def gaugeTree(config, gauges):
+    logging.debug("reading flow accumulation")
+    flowacc = readGrid(config, "flowacc")
+
+    logging.debug("reading flow direction")
+    flowdir = readGrid(config, "flowdir")
+
+    logging.info("tracing the nesting of the gauges")
+    # gauges given as a mask file are not part of the river network
+    tree = GaugeTree(
+        flowacc, flowdir, [g for g in gauges if not g.path], config["matching"]
+    )
+    # the extents of the extracted data, see alignMask
+    levels = config.get("levels")
+    bboxes = {
+        gauge_id: levelBbox(tree.bbox(gauge_id), levels or (), *flowdir.getCorner("ul"))
+        for gauge_id in tree.gauges
+    }
+    logging.debug("writing nesting: %s", config["nesting"])
+    tree.tofile(config["nesting"], bboxes)
+    return tree
 
 
 def gridBasinMask(gauge):
 
-    with NcDataset(gauge.path) as ncbase:
-        # Infer dimension/fill_value information from the file
-        var = ncbase.variables[gauge.varname]
-        if var.ndim > 2:
-            raise RuntimeError("Expected mask should not have more than 2 dimensions")
-
-        y, x = var.dimensions
-        # NOTE: would be a good to have y_shift and x_shift
-        #        as optional fields in the gauge lut.
-        with NcDimDataset(gauge.path, ydim=y, xdim=x, y_shift=0.5, x_shift=0.5) as nc:
-            origin = nc.origin
-            out = ga.array(
-                nc.variables[gauge.varname][:],
-                yorigin=nc.bbox["ymin" if origin[0] == "l" else "ymax"],
-                xorigin=nc.bbox["xmin" if origin[1] == "l" else "xmax"],
-                origin=origin,
-                fill_value=var.fill_value,
-                cellsize=nc.cellsize,
-            )
+    # the netCDF library is not thread-safe, see netcdf._LOCK
+    with _LOCK:
+        with NcDataset(gauge.path) as ncbase:
+            # Infer dimension/fill_value information from the file
+            var = ncbase.variables[gauge.varname]
+            if var.ndim > 2:
+                raise RuntimeError(
+                    "Expected mask should not have more than 2 dimensions"
+                )
+
+            y, x = var.dimensions
+            # NOTE: would be a good to have y_shift and x_shift
+            #        as optional fields in the gauge lut.
+            with NcDimDataset(
+                gauge.path, ydim=y, xdim=x, y_shift=0.5, x_shift=0.5
+            ) as nc:
+                origin = nc.origin
+                out = ga.array(
+                    nc.variables[gauge.varname][:],
+                    yorigin=nc.bbox["ymin" if origin[0] == "l" else "ymax"],
+                    xorigin=nc.bbox["xmin" if origin[1] == "l" else "xmax"],
+                    origin=origin,
+                    fill_value=var.fill_value,
+                    cellsize=nc.cellsize,
+                )
     return out.setMask(out <= 0)
 
 
@@ -104,6 +249,8 @@ def openNcFiles(flist):
             fitem.xdim,
             y_shift=fitem.y_shift,
             x_shift=fitem.x_shift,
+            chunk_mb=fitem.chunk_mb,
+            cache_mb=fitem.cache_mb,
         )
 
     return out
@@ -117,16 +264,101 @@ def openGridFiles(flist):
     return out
 
 
-def writeFiles(bpath, fdict):
-    for fitem, fobj in fdict.items():
-        path = os.path.join(bpath, fitem.outpath or "")
-        if not os.path.isdir(path):
-            os.makedirs(path)
-        fname = os.path.join(path, os.path.split(fitem.fname)[-1])
-        logging.debug("writing file: %s", fname)
+def poolMap(pool, func, items):
+    # map func over items, concurrently if a thread pool is given
+    if pool is None:
+        return list(map(func, items))
+    return list(pool.map(func, items))
+
+
+def extractGrid(fdict, mask, masks, cache=None, tiles=None):
+    logging.debug("processing: %s", fdict["fname"])
+    if tiles is not None and fdict["fname"] in tiles:
+        # only the tiles covering the basin are read, shared between gauges
+        griddata = tiles.read(fdict["fname"], **mask.bbox)
+    else:
+        griddata = ga.fromfile(fdict["fname"], cache=cache).shrink(**mask.bbox)
+    return GridFile(**fdict), maskData(griddata, mask, masks)
+
+
+def outputName(bpath, fitem):
+    path = os.path.join(bpath, fitem.outpath or "")
+    # other threads might create the same directory
+    os.makedirs(path, exist_ok=True)
+    return os.path.join(path, os.path.split(fitem.fname)[-1])
+
+
+def writeFile(fname, fitem, fobj, reopen=False):
+    logging.debug("writing file: %s", fname)
+    if isinstance(fitem, GridFile):
+        fobj.tofile(fname, options=fitem.options)
+    elif isinstance(fitem, NcFile):
+        # netCDF handles are not shared between threads
+        return fobj.tofile(fname, reopen=reopen, **fitem.varparams)
+    else:
         fobj.tofile(fname)
 
 
+def writeFiles(bpath, fdict, deferred=None, pool=None, reopen=False):
+    # chunk cache statistics of the ncfiles
+    reopen = reopen or pool is not None
+    metrics = {}
+    items = []
+    for fitem, fobj in fdict.items():
+        fname = outputName(bpath, fitem)
+        if deferred is not None and isinstance(fobj, NcDimWindow):
+            # written for all gauges at once, see writeDeferred
+            deferred.append((fobj, fname, fitem.varparams))
+            continue
+        items.append((fname, fitem, fobj))
+
+    results = poolMap(pool, lambda item: writeFile(*item, reopen), items)
+    for (_, fitem, _), stats in zip(items, results):
+        if stats is not None:
+            metrics[fitem.fname] = stats
+    return metrics
+
+
+def logCacheStats(fname, stats):
+    for vname, cache in stats.items():
+        logging.debug(
+            "chunk cache of %s/%s: %.1f MB, %d hits, %d misses",
+            fname,
+            vname,
+            cache["size"] / 2**20,
+            cache["hits"],
+            cache["misses"],
+        )
+
+
+def writeDeferred(deferred, pool=None):
+    # group the windows by their source file, every file is read only once
+    groups = {}
+    for window, fname, varparams in deferred:
+        groups.setdefault(id(window.nc), []).append((window, fname, varparams))
+
+    # the limit of open files is shared by the inputs written concurrently
+    max_open = None
+    if pool is not None and len(groups) > 1:
+        max_open = max(_openLimit() // len(groups), 1)
+
+    def _write(items):
+        windows, fnames, varparams = zip(*items)
+        source = windows[0].nc
+        logging.debug("writing %d files from: %s", len(fnames), source.filepath())
+        # netCDF handles are not shared between threads
+        stats = writeWindows(
+            list(windows),
+            list(fnames),
+            max_open=max_open,
+            reopen=pool is not None,
+            **varparams[0],
+        )
+        logCacheStats(source.filepath(), stats)
+
+    poolMap(pool, _write, list(groups.values()))
+
+
 def enlargeFiles(fdict, bbox):
     out = {}
     for fitem, fobj in fdict.items():
@@ -161,8 +393,12 @@ def sameExtend(fobjs):
     return True
 
 
-def writeReport(bpath, mask, scaling_factor, gauge):
-    size = (np.sum(~mask.mask) * np.prod(np.abs(mask.cellsize))) * scaling_factor**2
+def basinSize(mask, scaling_factor):
+    return (np.sum(~mask.mask) * np.prod(np.abs(mask.cellsize))) * scaling_factor**2
+
+
+def writeReport(bpath, mask, scaling_factor, gauge, metrics=None):
+    size = basinSize(mask, scaling_factor)
     error_size = (size - gauge.size) / gauge.size * 100
     Path(bpath).mkdir(exist_ok=True, parents=True)
     with open(os.path.join(bpath, "report.out"), "w") as f:
@@ -171,101 +407,760 @@ def writeReport(bpath, mask, scaling_factor, gauge):
         f.write("error_catchment_size (%) : {:}\n".format(error_size))
         f.write("adjusted_y               : {:}\n".format(gauge.y))
         f.write("adjusted_x               : {:}\n".format(gauge.x))
+        # estimated HDF5 chunk cache efficiency of the ncfiles reads
+        for fname, stats in (metrics or {}).items():
+            for vname, cache in stats.items():
+                f.write(
+                    "chunk_cache {:}/{:}: {:.1f} MB, {:} hits, {:} misses\n".format(
+                        os.path.split(fname)[-1],
+                        vname,
+                        cache["size"] / 2**20,
+                        cache["hits"],
+                        cache["misses"],
+                    )
+                )
+
+
+def summaryRow(gauge, mask=None, scaling_factor=1, **kwargs):
+    """
+    Arguments
+    ---------
+    gauge          : Gauge
+    mask           : GeoArray/None  # basin mask, None if not delineated
+    scaling_factor : float
+    kwargs         : additional fields (e.g. status, timings)
+
+    Returns
+    -------
+    dict
+
+    Purpose
+    -------
+    Collect the values of the given gauge written to the run summary.
+    """
+    out = {"id": gauge.id, "adjusted_y": gauge.y, "adjusted_x": gauge.x}
+    if mask is not None:
+        size = basinSize(mask, scaling_factor)
+        out["calculated_size"] = size
+        out["ncells"] = int(np.sum(~mask.mask))
+        out.update(mask.bbox)
+        # gauges given as a mask file have no size
+        if gauge.size is not None:
+            out["input_size"] = float(gauge.size)
+            if out["input_size"] > 0:
+                out["error_size"] = (size - out["input_size"]) / out["input_size"] * 100
+    out.update(kwargs)
+    return out
+
+
+def levelBbox(bbox, levels, yorigin, xorigin):
+    """
+    Enlarge the given bbox, so that its edges are aligned to the grids
+    of all given levels (i.e. cellsizes) anchored at yorigin, xorigin.
+    For nested levels, the bbox is aligned to the coarsest one.
+    """
+
+    def _snap(value, cellsize, func):
+        # the tolerance accounts for rounding errors of the coordinates
+        tol = 1e-6 if func is np.floor else -1e-6
+        return func(value / cellsize + tol) * cellsize
+
+    out = dict(bbox)
+    for cellsize in sorted(abs(float(c)) for c in levels):
+        out["ymax"] = yorigin - _snap(yorigin - out["ymax"], cellsize, np.floor)
+        out["ymin"] = yorigin - _snap(yorigin - out["ymin"], cellsize, np.ceil)
+        out["xmin"] = xorigin + _snap(out["xmin"] - xorigin, cellsize, np.floor)
+        out["xmax"] = xorigin + _snap(out["xmax"] - xorigin, cellsize, np.ceil)
+    return out
 
 
-def maskData(data, mask):
+def alignMask(mask, levels, reference):
+    """
+    Pad the mask with fill values, so that its extend is aligned to all
+    levels given in the input file. The levels are anchored at the
+    reference corner (i.e. upper left corner of the L0 grid).
+    """
+    if not levels:
+        return mask
+
+    bbox = levelBbox(mask.bbox, levels, *reference)
+    ycs, xcs = (float(abs(c)) for c in mask.cellsize)
+    return mask.addCells(
+        top=int(round((bbox["ymax"] - mask.bbox["ymax"]) / ycs)),
+        left=int(round((mask.bbox["xmin"] - bbox["xmin"]) / xcs)),
+        bottom=int(round((mask.bbox["ymin"] - bbox["ymin"]) / ycs)),
+        right=int(round((bbox["xmax"] - mask.bbox["xmax"]) / xcs)),
+    )
+
+
+def gridKey(grid):
+    """
+    A hashable key describing resolution and alignment of the given grid.
+    """
+    bbox = grid.bbox
+    values = [abs(c) for c in grid.cellsize]
+    values += [bbox[k] for k in ("ymin", "ymax", "xmin", "xmax")]
+    return tuple(round(float(v), 8) for v in values)
+
+
+def maskData(data, mask, masks=None):
+    """
+    Mask the given data with the basin mask. If the resolution of the data
+    differs, the mask is rescaled to the data grid. Rescaled masks are
+    stored in the optional dictionary masks, so every grid (i.e. mHM level)
+    is only computed once per gauge.
+    """
     if all(x == y for x, y in zip(mask.cellsize, data.cellsize)):
         return data.setMask(mask.mask)
 
+    key = gridKey(data)
+    if masks is not None and key in masks:
+        logging.debug("reusing mask for cellsize: %s", key[:2])
+        return data.setMask(masks[key])
+
+    # integer cellsize ratios (e.g. L0 -> L1) are block reduced with numpy,
+    # all other ratios are warped with GDAL
     enlarged_mask = mask.enlarge(**data.bbox).astype(float)
     rescaled_mask = ga.rescale(
         enlarged_mask, abs(data.cellsize[0] / mask.cellsize[0]), func="average"
     ).copy()
+    if masks is not None:
+        masks[key] = rescaled_mask.mask
     return data.setMask(rescaled_mask.mask)
 
 
 def main(config, gauges):
 
-    for gauge in gauges:
-        logging.info("processing gauge: %s", gauge.id)
+    # collect the ncfiles windows of all gauges and write them at the end
+    deferred = [] if config.get("multi-gauge", False) else None
 
-        filedict = {}
+    # the datasets are opened once, the data is only read when writing
+    ncfiles = openNcFiles(config.get("ncfiles"))
 
-        if not gauge.path:
+    # files of a gauge are read and written concurrently by up to
+    # 'threads' threads, i.e. this bounds the concurrent I/O streams
+    threads = int(config.get("threads", 1) or 1)
+    pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
 
+    # the gauge directories are packed into a few shard archives
+    archive = (
+        Archive(config["outpath"], **config["archive"])
+        if config.get("archive")
+        else None
+    )
+    # rasters exceeding the memory limit are not read in full, see readMode
+    modes = logReadModes(config) if config.get("memory_limit") else {}
+    # all basins are delineated at once, as unions of the nested basins
+    tree = gaugeTree(config, gauges) if config.get("nesting") else None
+
+    # decoded tiles of the gridfiles, shared by consecutive gauges
+    tiles = None
+    if config.get("tile-cache") or config.get("prefetch"):
+        tiles = ga.TileCache(config.get("tile-cache") or 256, cache=config.get("cache"))
+    elif "tiles" in modes.values():
+        tiles = ga.TileCache(
+            float(config["memory_limit"]) / 4,
+            cache=config.get("cache"),
+            fnames=[fname for fname, mode in modes.items() if mode == "tiles"],
+        )
+    # the windows of the next gauges are read into the tile cache, while
+    # the current ones are processed (the bboxes are known from the tree)
+    prefetcher = None
+    if config.get("prefetch"):
+        if tree is None:
+            logging.warning("prefetching requires the nesting of the gauges")
+        else:
+            prefetcher = ga.Prefetcher(tiles, config["prefetch"])
+    # the unpacked output of a failed run is kept, see Archive.close
+    failed = True
+    try:
+        processed = processGauges(
+            config, gauges, ncfiles, deferred, pool, archive, tree, tiles, prefetcher
+        )
+        if deferred:
+            logging.info("writing ncfiles of all gauges")
+            writeDeferred(deferred, pool)
+        if archive is not None and deferred is not None:
+            for gauge_id in processed:
+                archive.add(gauge_id)
+        failed = False
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+        if tiles is not None:
+            logging.info(
+                "tile cache: %d hits, %d misses, %d prefetched (hit ratio %.1f %%)",
+                tiles.hits,
+                tiles.misses,
+                tiles.prefetched,
+                100 * tiles.hit_ratio,
+            )
+        if pool is not None:
+            pool.shutdown()
+        if archive is not None:
+            archive.close(keep=failed)
+        for ncdata in ncfiles.values():
+            ncdata.close()
+
+
+def gaugeCost(gauge, tree=None):
+    """
+    Arguments
+    ---------
+    gauge : Gauge
+    tree  : GaugeTree/None
+
+    Returns
+    -------
+    float
+
+    Purpose
+    -------
+    Estimate the processing cost of the given gauge, i.e. the flow
+    accumulation at the matched cell (the cells to delineate and mask)
+    plus the cells of the basin extent (the data to read and write). Without
+    a GaugeTree only the size from the gauges look up table is known.
+    """
+    if tree is not None and gauge.id in tree.gauges:
+        bbox = tree.bbox(gauge.id)
+        ycs, xcs = (abs(c) for c in tree.flowdir.cellsize)
+        window = ((bbox["ymax"] - bbox["ymin"]) / ycs) * (
+            (bbox["xmax"] - bbox["xmin"]) / xcs
+        )
+        return float(tree.flowacc.data[tree.cells[gauge.id]]) + window
+    try:
+        return float(gauge.size or 0)
+    except ValueError:
+        return 0.0
+
+
+def completed(func, items, workers=1):
+    """
+    Arguments
+    ---------
+    func    : callable
+    items   : list
+    workers : int  # number of threads
+
+    Returns
+    -------
+    generator of (item, Future)
+
+    Purpose
+    -------
+    Call func for all items and yield every item together with its (done)
+    future in the order of completion. With more than one worker, the items
+    are taken from a shared queue in the given order, so a worker picks up
+    the next item as soon as it is idle.
+    """
+    if workers <= 1:
+        for item in items:
+            future = Future()
+            try:
+                future.set_result(func(item))
+            except Exception as exc:
+                future.set_exception(exc)
+            yield item, future
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gauge") as pool:
+        futures = {pool.submit(func, item): item for item in items}
+        try:
+            for future in as_completed(futures):
+                yield futures[future], future
+        finally:
+            # e.g. after a failed gauge
+            for future in futures:
+                future.cancel()
+
+
+def logBalance(busy, elapsed):
+    """
+    Arguments
+    ---------
+    busy    : dict   # worker -> list of the durations of its gauges
+    elapsed : float  # wall time of all gauges
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Report the load of the workers, the efficiency is the fraction of
+    the available worker time spent on gauges.
+    """
+    totals = {worker: sum(times) for worker, times in busy.items()}
+    if not totals or elapsed <= 0:
+        return
+    for worker, total in sorted(totals.items()):
+        logging.debug("worker %s: %d gauges, %.1f s", worker, len(busy[worker]), total)
+    logging.info(
+        "load balance: %d workers, busy %.1f - %.1f s (mean %.1f s), "
+        "efficiency %.0f%% of %.1f s",
+        len(totals),
+        min(totals.values()),
+        max(totals.values()),
+        np.mean(list(totals.values())),
+        100.0 * sum(totals.values()) / (len(totals) * elapsed),
+        elapsed,
+    )
+
+
+def orderGauges(config, gauges, tree=None):
+    """
+    Arguments
+    ---------
+    config : dict            # content of the input file
+    gauges : list of Gauge
+    tree   : GaugeTree/None
+
+    Returns
+    -------
+    list of Gauge
+
+    Purpose
+    -------
+    Sort the gauges by the 'order' key: 'input' keeps the order of the
+    look up table, 'size' dispatches the most expensive gauges first (see
+    gaugeCost) and 'hilbert' processes neighbouring gauges consecutively.
+    """
+    workers = int(config.get("workers", 1) or 1)
+    order = config.get("order", "size" if workers > 1 else "input")
+    if order == "size":
+        return sorted(gauges, key=lambda g: gaugeCost(g, tree), reverse=True)
+    if order == "hilbert":
+        return hilbertOrder(gauges)
+    if order != "input":
+        raise ValueError("Supported gauge orders are: input, size, hilbert")
+    return list(gauges)
+
+
+def gaugeReads(config, gauge, tree):
+    """
+    Arguments
+    ---------
+    config : dict       # content of the input file
+    gauge  : Gauge
+    tree   : GaugeTree
+
+    Returns
+    -------
+    list of (str, dict) tuples
+
+    Purpose
+    -------
+    The gridfiles and bboxes read for the given gauge, i.e. the extent of
+    its basin aligned to the levels (see alignMask), without a mask.
+    """
+    if gauge.path or gauge.id not in tree.gauges:
+        return []
+    bbox = levelBbox(
+        tree.bbox(gauge.id), config.get("levels") or (), *tree.flowdir.getCorner("ul")
+    )
+    return [(fdict["fname"], bbox) for fdict in config.get("gridfiles", [])]
+
+
+def gaugePath(config, gauge_id, archive=None):
+    # output directory of the given gauge
+    if archive is not None:
+        return archive.gaugePath(gauge_id)
+    return os.path.join(config["outpath"], gauge_id)
+
+
+def duplicateGauges(config, gauges, tree=None):
+    """
+    Arguments
+    ---------
+    config : dict            # content of the input file
+    gauges : list of Gauge   # in dispatch order
+    tree   : GaugeTree/None
+
+    Returns
+    -------
+    dict  # gauge id -> list of matched Gauge
+
+    Purpose
+    -------
+    Group the gauges by the cell they are matched to. The first gauge of
+    a group is processed, the others (i.e. duplicates) are mapped to it.
+    """
+    if tree is not None:
+        matched = [
+            (tree.gauges[g.id], tree.cells[g.id]) for g in gauges if g.id in tree.gauges
+        ]
+    else:
+        logging.debug("matching the gauges to find duplicates")
+        flowacc = readGrid(config, "flowacc")
+        matched = gaugeCells(
+            [g for g in gauges if not g.path], flowacc, config["matching"]
+        )
+
+    first = {}
+    out = {}
+    for gauge, cell in matched:
+        cell = tuple(int(i) for i in cell)
+        if cell in first:
+            out.setdefault(first[cell], []).append(gauge)
+        else:
+            first[cell] = gauge.id
+    return out
+
+
+def linkFiles(src, dst, skip=(), copy=False):
+    """
+    Arguments
+    ---------
+    src  : str          # output directory of a gauge
+    dst  : str          # output directory of its duplicate
+    skip : list of str  # files written for every gauge (relative to src)
+    copy : bool         # copy instead of hardlinking the files
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Mirror the output files of a gauge. Files are hardlinked, if the file
+    system supports it, and copied otherwise.
+    """
+    for root, _, files in os.walk(src):
+        for name in files:
+            fname = os.path.join(root, name)
+            relname = os.path.relpath(fname, src)
+            if relname in skip:
+                continue
+            target = os.path.join(dst, relname)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            if os.path.lexists(target):
+                os.remove(target)
+            if not copy:
+                try:
+                    os.link(fname, target)
+                    continue
+                except OSError:
+                    pass
+            shutil.copy2(fname, target)
+
+
+def writeDuplicate(config, gauge, mask, duplicate, deferred=None, archive=None):
+    """
+    Arguments
+    ---------
+    config    : dict       # content of the input file
+    gauge     : Gauge      # processed gauge
+    mask      : GeoArray   # its basin mask
+    duplicate : Gauge      # matched to the same cell
+    deferred  : list/None  # ncfiles windows, see writeDeferred
+    archive   : Archive/None
+
+    Returns
+    -------
+    None
+
+    Purpose
+    -------
+    Write the output of a duplicate gauge from the output of the gauge
+    matched to the same cell: the data files are linked (or copied), only
+    the gauge grid and the report are written for the duplicate itself.
+    """
+    src = gaugePath(config, gauge.id, archive)
+    dst = gaugePath(config, duplicate.id, archive)
+    copy = config["deduplicate"] == "copy"
+
+    skip = ["report.out"]
+    if "gauge" in config:
+        fitem = GridFile(
+            fname=config["gauge"].get("fname", "idgauges.asc"),
+            outpath=config["gauge"].get("outpath"),
+            options=config["gauge"].get("options"),
+        )
+        skip.append(os.path.relpath(outputName(src, fitem), src))
+    linkFiles(src, dst, skip, copy)
+
+    if "gauge" in config:
+        # the same cell, labeled with the id of the duplicate
+        gaugefile = ga.fromfile(outputName(src, fitem))
+        gaugefile.data[~gaugefile.mask] = duplicate.id
+        gaugefile.tofile(outputName(dst, fitem), options=fitem.options)
+
+    if deferred is not None:
+        # the ncfiles are written in the same pass, see writeDeferred
+        prefix = os.path.join(src, "")
+        for window, fname, varparams in list(deferred):
+            if fname.startswith(prefix):
+                target = os.path.join(dst, os.path.relpath(fname, src))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                deferred.append((window, target, varparams))
+
+    if config.get("report", True):
+        writeReport(dst, mask, config["matching"]["scaling_factor"], duplicate)
+
+
+def processGauges(
+    config,
+    gauges,
+    ncfiles,
+    deferred=None,
+    pool=None,
+    archive=None,
+    tree=None,
+    tiles=None,
+    prefetcher=None,
+):
+
+    # one row per gauge in the run summary, written as soon as it is done
+    summary = Summary(config["summary"]) if config.get("summary") else None
+    scaling_factor = config["matching"]["scaling_factor"]
+
+    # gauges processed concurrently, by default the largest ones first
+    workers = int(config.get("workers", 1) or 1)
+    gauges = orderGauges(config, gauges, tree)
+
+    # gauges matched to the same cell are processed only once
+    duplicates = {}
+    if config.get("deduplicate"):
+        if config["deduplicate"] not in ("link", "copy"):
+            raise ValueError("Supported deduplicate modes are: link, copy")
+        duplicates = duplicateGauges(config, gauges, tree)
+        skip = {d.id for dups in duplicates.values() for d in dups}
+        gauges = [g for g in gauges if g.id not in skip]
+        if skip:
+            logging.info("%d gauges are duplicates of others", len(skip))
+
+    # gauges dispatched after the given one, read ahead by the prefetcher
+    depth = prefetcher.depth if prefetcher is not None else 0
+    upcoming = {
+        gauge.id: gauges[i + 1 : i + 1 + depth] for i, gauge in enumerate(gauges)
+    }
+
+    def _process(job):
+        gauge, timings = job
+        logging.info("processing gauge: %s", gauge.id)
+        tstart = time.perf_counter()
+        if prefetcher is not None:
+            for other in upcoming[gauge.id]:
+                prefetcher.submit(other.id, gaugeReads(config, other, tree))
+        try:
+            return processGauge(
+                config,
+                gauge,
+                ncfiles,
+                timings,
+                deferred,
+                pool,
+                archive,
+                tree,
+                tiles,
+                reopen=workers > 1,
+            )
+        finally:
+            timings["time_total"] = time.perf_counter() - tstart
+            timings["worker"] = threading.current_thread().name
+
+    # ids of the gauges written
+    processed = []
+    # durations of the gauges per worker
+    busy = {}
+
+    tstart = time.perf_counter()
+    jobs = [(gauge, {}) for gauge in gauges]
+    for (gauge, timings), future in completed(_process, jobs, workers):
+        busy.setdefault(timings["worker"], []).append(timings["time_total"])
+
+        if future.exception() is not None:
+            if summary is not None:
+                summary.add(
+                    summaryRow(
+                        gauge,
+                        status="failed",
+                        message=str(future.exception()),
+                        **timings,
+                    )
+                )
+            raise future.exception()
+
+        result = future.result()
+        if result is None:
+            if summary is not None:
+                summary.add(summaryRow(gauge, status="unmatched", **timings))
+            continue
+
+        gauge, mask = result
+        processed.append(gauge.id)
+
+        if summary is not None:
+            summary.add(summaryRow(gauge, mask, scaling_factor, status="ok", **timings))
+
+        for duplicate in duplicates.get(gauge.id, []):
+            logging.info("linking gauge: %s to %s", duplicate.id, gauge.id)
+            tlink = time.perf_counter()
+            writeDuplicate(config, gauge, mask, duplicate, deferred, archive)
+            processed.append(duplicate.id)
+            if summary is not None:
+                summary.add(
+                    summaryRow(
+                        duplicate,
+                        mask,
+                        scaling_factor,
+                        status="duplicate",
+                        message="same cell as {:}".format(gauge.id),
+                        time_total=time.perf_counter() - tlink,
+                    )
+                )
+
+        # deferred ncfiles are not written yet, see main
+        if archive is not None and deferred is None:
+            archive.add(gauge.id)
+            for duplicate in duplicates.get(gauge.id, []):
+                archive.add(duplicate.id)
+
+    if workers > 1:
+        logBalance(busy, time.perf_counter() - tstart)
+
+    return processed
+
+
+def processGauge(
+    config,
+    gauge,
+    ncfiles,
+    timings,
+    deferred=None,
+    pool=None,
+    archive=None,
+    tree=None,
+    tiles=None,
+    reopen=False,
+):
+    """
+    Arguments
+    ---------
+    config   : dict              # content of the input file
+    gauge    : Gauge
+    ncfiles  : dict              # NcFile -> NcDimDataset, see openNcFiles
+    timings  : dict              # filled with the durations of the steps
+    deferred : list/None         # collects the ncfiles windows, see writeDeferred
+    pool     : ThreadPoolExecutor/None
+    archive  : Archive/None
+    tree     : GaugeTree/None     # matched and nested gauges, see gaugeTree
+    tiles    : TileCache/None     # shared tiles of the gridfiles
+    reopen   : bool               # use own netCDF handles, i.e. for concurrent gauges
+
+    Returns
+    -------
+    (Gauge, GeoArray) or None
+
+    Purpose
+    -------
+    Delineate the basin of the given gauge and write its files. Returns the
+    (matched) gauge and the basin mask or None if the gauge could not be matched.
+    """
+
+    cache = config.get("cache")
+    levels = config.get("levels")
+    tstart = time.perf_counter()
+
+    filedict = {}
+    # rescaled masks, one per distinct data grid
+    masks = {}
+
+    if not gauge.path:
+
+        if tree is not None:
+            # matched and delineated for all gauges at once
+            flowacc, flowdir = tree.flowacc, tree.flowdir
+            gauge = tree.gauges.get(gauge.id)
+        else:
             # create mask if not given
             logging.debug("reading flow accumulation")
-            flowacc = ga.fromfile(config["flowacc"]).astype(np.int32)
+            flowacc = readGrid(config, "flowacc")
 
             logging.debug("reading flow direction")
-            flowdir = ga.fromfile(config["flowdir"]).astype(np.int32)
+            flowdir = readGrid(config, "flowdir")
 
             if gauge.size:
                 logging.debug("moving gauge to streamflow")
                 gauge = matchFlowacc(gauge, flowacc, **config["matching"])
 
-            if not gauge:
-                warnings.warn("Failed to match the gauge to the flow accumulation grid")
-                continue
-
-            logging.debug("generating basin mask")
-            mask = gaugeBasinMask(flowdir, gauge)
-
-            # write gauge grid if desired
-            if "gauge" in config:
-                logging.debug("writing gauge file")
-                fitem = GridFile(
-                    fname=config["gauge"].get("fname", "idgauges.asc"),
-                    outpath=config["gauge"].get("outpath"),
-                )
-                gaugefile = gaugeGrid(flowacc, gauge).shrink(**mask.bbox)
-                filedict[fitem] = maskData(gaugefile, mask)
+        if not gauge:
+            warnings.warn("Failed to match the gauge to the flow accumulation grid")
+            return None
 
+        logging.debug("generating basin mask")
+        if tree is not None:
+            mask = tree.mask(gauge.id)
         else:
-            logging.debug("reding gauge file")
-            mask = gridBasinMask(gauge)
-
-        for fdict in config.get("gridfiles", []):
-            logging.debug("processing: %s", fdict["fname"])
-            griddata = ga.fromfile(fdict["fname"]).shrink(**mask.bbox)
-            filedict[GridFile(**fdict)] = maskData(griddata, mask)
-
-        for fdict in config.get("ncfiles", []):
-            logging.debug("processing: %s", fdict["fname"])
-            fitem = NcFile(**fdict)
-            ncdata = NcDimDataset(
-                fitem.fname,
-                "r",
-                fitem.ydim,
-                fitem.xdim,
-                y_shift=fitem.y_shift,
-                x_shift=fitem.x_shift,
-            )
-            filedict[NcFile(**fdict)] = maskData(ncdata.shrink(**mask.bbox), mask)
+            mask = gaugeBasinMask(flowdir, gauge)
+        mask = alignMask(mask, levels, flowdir.getCorner("ul"))
 
-        # write mask grid if desired
-        if "mask" in config:
-            logging.debug("writing mask file")
+        # write gauge grid if desired
+        if "gauge" in config:
+            logging.debug("writing gauge file")
             fitem = GridFile(
-                fname=config["mask"].get("fname", "mask.asc"),
-                outpath=config["mask"].get("outpath"),
+                fname=config["gauge"].get("fname", "idgauges.asc"),
+                outpath=config["gauge"].get("outpath"),
+                options=config["gauge"].get("options"),
             )
-            filedict[fitem] = mask
+            # only the window of the basin is allocated
+            gaugefile = gaugeGrid(flowacc.shrink(**mask.bbox).astype(np.int32), gauge)
+            filedict[fitem] = maskData(gaugefile, mask, masks)
+
+    else:
+        logging.debug("reding gauge file")
+        mask = gridBasinMask(gauge)
+        mask = alignMask(mask, levels, mask.getCorner("ul"))
+
+    timings["time_mask"] = time.perf_counter() - tstart
+
+    gridfiles = poolMap(
+        pool,
+        lambda fdict: extractGrid(fdict, mask, masks, cache, tiles),
+        config.get("gridfiles", []),
+    )
+    for fitem, griddata in gridfiles:
+        filedict[fitem] = griddata
+
+    for fitem, ncdata in ncfiles.items():
+        logging.debug("processing: %s", fitem.fname)
+        # the data is only read when writing, in chunks
+        window = ncdata.window(**mask.bbox).period(fitem.start, fitem.end)
+        filedict[fitem] = maskData(window, mask, masks)
+
+    # write mask grid if desired
+    if "mask" in config:
+        logging.debug("writing mask file")
+        fitem = GridFile(
+            fname=config["mask"].get("fname", "mask.asc"),
+            outpath=config["mask"].get("outpath"),
+            options=config["mask"].get("options"),
+        )
+        filedict[fitem] = mask
 
-        if filedict:
-            logging.debug("finding common extend")
-            bbox = commonBbox(tuple(filedict.values()))
+    if filedict:
+        logging.debug("finding common extend")
+        bbox = commonBbox(tuple(filedict.values()))
 
-            logging.debug("enlarging data to common extend")
-            filedict = enlargeFiles(filedict, bbox)
+        logging.debug("enlarging data to common extend")
+        filedict = enlargeFiles(filedict, bbox)
 
-            if not sameExtend(tuple(filedict.values())):
-                raise RuntimeError("incompatible cellsizes")
+        if not sameExtend(tuple(filedict.values())):
+            raise RuntimeError("incompatible cellsizes")
 
-        bpath = os.path.join(config["outpath"], gauge.id)
-        writeFiles(bpath, filedict)
+    timings["time_extract"] = time.perf_counter() - tstart - timings["time_mask"]
+
+    bpath = gaugePath(config, gauge.id, archive)
+    metrics = writeFiles(bpath, filedict, deferred, pool, reopen)
+    for fname, stats in metrics.items():
+        logCacheStats(fname, stats)
+    if config.get("report", True):
         logging.debug("writing report")
-        writeReport(bpath, mask, config["matching"]["scaling_factor"], gauge)
+        writeReport(bpath, mask, config["matching"]["scaling_factor"], gauge, metrics)
+    timings["time_write"] = (
+        time.perf_counter() - tstart - timings["time_mask"] - timings["time_extract"]
+    )
+    return gauge, mask
 
 
 def initArgparser():
@@ -301,6 +1196,39 @@ def initArgparser():
 
     parser.add_argument("--version", action="version", version=__version__)
 
+    subparsers = parser.add_subparsers(dest="command")
+    unpacker = subparsers.add_parser(
+        "unpack",
+        help="restore the directory layout from archives written with 'archive'",
+    )
+    unpacker.add_argument("archives", nargs="+", help="the archives to extract")
+    unpacker.add_argument(
+        "-o",
+        "--outpath",
+        default=".",
+        help="the directory to extract to (default: '.')",
+    )
+
+    labeler = subparsers.add_parser(
+        "label",
+        help="write a grid holding the id of the nearest downstream gauge in every cell",
+    )
+    labeler.add_argument(
+        "-o",
+        "--output",
+        default="labels.asc",
+        help="the label grid to write (default: 'labels.asc')",
+    )
+    labeler.add_argument(
+        "-t",
+        "--threshold",
+        type=float,
+        help=(
+            "label the basins of all outlets with a flow accumulation of at least "
+            "threshold instead of the gauges"
+        ),
+    )
+
     return parser
 
 
@@ -1,10 +1,197 @@
 # -*- coding: utf-8 -*-
 
 import os
+import threading
 
 import numpy as np
+from netCDF4 import default_fillvals
 
+from .gauges import hilbertIndex
 from .netcdf4 import NcDataset
+from .netcdf4.netcdf4 import rawAccess
+
+# default size of the data chunks processed at once [MB]
+CHUNK_MB = 256
+
+# maximum number of output files written at once by writeWindows, if the
+# limit of open files is unknown (see _openLimit)
+MAX_OPEN = 256
+
+# file descriptors left to the inputs and other files, see _openLimit
+RESERVED_FILES = 64
+
+# approximate size of the default chunks of the output variables [bytes]
+CHUNK_BYTES = 2**20
+
+# maximum size of the HDF5 chunk cache of an input variable [MB]
+CACHE_MB = 64
+
+# serializes the netCDF library calls of concurrent threads
+_LOCK = threading.RLock()
+
+
+def _chunkSlices(var, skip, chunk_mb=None, shape=None, align=None):
+    """
+    Split the given variable along its leading dimension not given in skip
+    (i.e. time) into chunks of about chunk_mb megabytes. Yields tuples
+    of slices for all dimensions of var. The chunk size is derived from
+    shape, if given (e.g. the shape of a window into var). If given, the
+    chunk length is rounded down to a multiple of align (i.e. the HDF5
+    chunk length of var along that dimension).
+    """
+    dims = var.dimensions
+    shape = var.shape if shape is None else shape
+    try:
+        axis = next(i for i, d in enumerate(dims) if d not in skip)
+    except StopIteration:
+        yield tuple(slice(None) for _ in dims)
+        return
+
+    slab = var.dtype.itemsize * int(np.prod(shape)) // max(shape[axis], 1)
+    step = max(1, int((chunk_mb or CHUNK_MB) * 2**20) // max(slab, 1))
+    if align and step > align:
+        step = step // align * align
+    for start in range(0, shape[axis], step):
+        slices = [slice(None)] * len(dims)
+        # explicit stops, unlimited dimensions would grow otherwise
+        slices[axis] = slice(start, min(start + step, shape[axis]))
+        yield tuple(slices)
+
+
+def _expandMask(mask, dims, ydim, xdim):
+    """
+    Bring the given 2D (y, x) mask to a shape, that broadcasts against
+    a variable with the given dimensions.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    iy, ix = dims.index(ydim), dims.index(xdim)
+    shape = [1] * len(dims)
+    shape[iy], shape[ix] = mask.shape
+    return (mask.T if iy > ix else mask).reshape(shape)
+
+
+def _cachePlan(var, reads, cache_mb=None):
+    """
+    Arguments
+    ---------
+    var      : NcVariable
+    reads    : list of tuples of (absolute) slices, the hyperslabs read
+               from var one after another
+    cache_mb : float, upper limit of the chunk cache size in MB
+
+    Return
+    ------
+    dict with the cache size (bytes), number of slots and the estimated
+    chunk accesses, hits and misses or None for contiguous variables
+
+    Purpose
+    -------
+    Plan the HDF5 chunk cache of var, so it holds all chunks touched by
+    a single read. Chunks shared by consecutive reads (i.e. time chunks
+    longer than a read) are then decompressed only once. The estimate
+    assumes an LRU cache, that is either large enough or thrashes.
+    """
+    chunking = var.chunking()
+    if not reads or isinstance(chunking, str):
+        return None
+
+    def _range(start, stop, size):
+        # indices of the first and last chunk touched
+        return start // size, (max(stop, start + 1) - 1) // size
+
+    touched = []
+    union = [[np.inf, -np.inf] for _ in chunking]
+    for read in reads:
+        count = 1
+        for i, (sl, size, length) in enumerate(zip(read, chunking, var.shape)):
+            first, last = _range(*sl.indices(length)[:2], size)
+            union[i] = [min(union[i][0], first), max(union[i][1], last)]
+            count *= last - first + 1
+        touched.append(count)
+
+    chunk_bytes = var.dtype.itemsize * int(np.prod(chunking))
+    needed = max(touched) * chunk_bytes
+    limit = int((cache_mb or CACHE_MB) * 2**20)
+    accesses = sum(touched)
+    unique = int(np.prod([last - first + 1 for first, last in union]))
+    misses = unique if needed <= limit else accesses
+    return {
+        "size": min(needed, limit),
+        # HDF5 recommends far more slots than chunks in the cache
+        "nelems": 100 * max(touched) + 1,
+        "accesses": accesses,
+        "hits": accesses - misses,
+        "misses": misses,
+    }
+
+
+def _outputChunks(var, shape, spatial, chunksizes=None):
+    """
+    Chunk shape of an output variable with the given shape. Sizes given
+    in chunksizes (dimension name -> size) take precedence. By default a
+    chunk holds the entire time series (i.e. all non-spatial dimensions)
+    of a square block of cells and about CHUNK_BYTES of data, so reading
+    the time series of a single cell touches only one chunk.
+    """
+    chunksizes = chunksizes or {}
+    out = [max(n, 1) for n in shape]
+
+    nonspatial = [i for i, d in enumerate(var.dimensions) if d not in spatial]
+    nbytes = var.dtype.itemsize * int(np.prod([out[i] for i in nonspatial]))
+    if nonspatial and nbytes > CHUNK_BYTES:
+        # series longer than a chunk, split the leading dimension
+        axis, length = nonspatial[0], out[nonspatial[0]]
+        out[axis] = max(1, length * CHUNK_BYTES // nbytes)
+        nbytes = nbytes // length * out[axis]
+
+    side = max(1, int(np.sqrt(CHUNK_BYTES // max(nbytes, 1))))
+    for i, dim in enumerate(var.dimensions):
+        if dim in spatial:
+            out[i] = min(side, out[i])
+        if dim in chunksizes:
+            out[i] = min(max(int(chunksizes[dim]), 1), max(shape[i], 1))
+    return tuple(out)
+
+
+def _fillValue(var):
+    # the value used for masked and padded cells
+    if var.fill_value is not None:
+        return var.fill_value
+    return default_fillvals.get(var.dtype.str[1:])
+
+
+def _dateKey(value, end=False):
+    """
+    Sortable integer (i.e. yyyymmdd) of the given date. value might be
+    a date/datetime/cftime object, a year or a (partial) ISO date string
+    (i.e. "1990", "1990-05" or "1990-05-17"). Partial dates are completed
+    to the first (end=False) or last day (end=True) of the period.
+    """
+    if hasattr(value, "year"):
+        parts = [value.year, value.month, value.day]
+    else:
+        parts = [int(p) for p in str(value).split("T")[0].split()[0].split("-")]
+    parts += ([12, 31] if end else [1, 1])[len(parts) - 1 :]
+    return parts[0] * 10000 + parts[1] * 100 + parts[2]
+
+
+def _within(chunk, outer):
+    # the slice chunk, given relative to the slice outer, in absolute indices
+    start, stop, _ = chunk.indices(outer.stop - outer.start)
+    return slice(outer.start + start, outer.start + stop)
+
+
+def _asciiHeader(ncols, nrows, bbox, cellsize, fill_value):
+    return "\n".join(
+        [
+            "ncols\t{0}".format(ncols),
+            "nrows\t{0}".format(nrows),
+            "xllcorner\t{0}".format(bbox["xmin"]),
+            "yllcorner\t{0}".format(bbox["ymin"]),
+            "cellsize\t{0}".format(abs(cellsize[0])),
+            "NODATA_value\t{0}\n".format(fill_value),
+        ]
+    )
 
 
 class NcDimDataset(NcDataset):
@@ -17,16 +204,52 @@ class NcDimDataset(NcDataset):
         cellsize=None,
         y_shift=1,
         x_shift=0,
+        chunk_mb=None,
+        cache_mb=None,
         *args,
         **kwargs,
     ):
         # shift_factor: the fraction of a cellsize the origin is shifted
+        # chunk_mb: size of the data chunks processed at once in MB
+        # cache_mb: maximum size of the HDF5 chunk cache per variable in MB
         super(NcDimDataset, self).__init__(fname, mode, *args, **kwargs)
         self.__dict__["_y"] = ydim
         self.__dict__["_x"] = xdim
         self.__dict__["_cellsize"] = cellsize
         self.__dict__["y_shift"] = float(y_shift)
         self.__dict__["x_shift"] = float(x_shift)
+        self.__dict__["chunk_mb"] = chunk_mb or CHUNK_MB
+        self.__dict__["cache_mb"] = cache_mb or CACHE_MB
+
+    def _emptyLike(self):
+        # an empty in-memory dataset sharing the dimension information
+        return NcDimDataset(
+            None,
+            "w",
+            self._y,
+            self._x,
+            self.cellsize,
+            self.y_shift,
+            self.x_shift,
+            self.chunk_mb,
+            self.cache_mb,
+        )
+
+    def reopen(self):
+        """
+        A new, independent handle of the same file (e.g. for other threads).
+        """
+        return NcDimDataset(
+            self.filepath(),
+            "r",
+            self._y,
+            self._x,
+            self._cellsize,
+            self.y_shift,
+            self.x_shift,
+            self.chunk_mb,
+            self.cache_mb,
+        )
 
     # def _delta(self):
     # ycs, xcs = np.abs(self.cellsize)
@@ -34,8 +257,9 @@ class NcDimDataset(NcDataset):
 
     @property
     def bbox(self):
-        x = self.variables[self._x][:]
-        y = self.variables[self._y][:]
+        with _LOCK:
+            x = self.variables[self._x][:]
+            y = self.variables[self._y][:]
         ycs, xcs = [abs(v) for v in self.cellsize]
 
         return {
@@ -54,8 +278,9 @@ class NcDimDataset(NcDataset):
     @property
     def cellsize(self):
         if self._cellsize is None:
-            y = self.variables[self._y][:2]
-            x = self.variables[self._x][:2]
+            with _LOCK:
+                y = self.variables[self._y][:2]
+                x = self.variables[self._x][:2]
             try:
                 self.__dict__["_cellsize"] = (y[1] - y[0], x[1] - x[0])
             except IndexError:
@@ -66,7 +291,8 @@ class NcDimDataset(NcDataset):
     def fill_values(self):
         return {k: v.fill_value for k, v in self.variables.items()}
 
-    def shrink(self, ymin, ymax, xmin, xmax):
+    def _shrinkSlices(self, ymin, ymax, xmin, xmax):
+        # index slices along y and x covering the given bbox
         def _removeCells(ymin, ymax, xmin, xmax):
             cellsize = [float(abs(v)) for v in self.cellsize]
             out = {
@@ -75,11 +301,13 @@ class NcDimDataset(NcDataset):
                 "bottom": int(np.floor((ymin - self.bbox["ymin"]) / cellsize[0])),
                 "right": int(np.floor((self.bbox["xmax"] - xmax) / cellsize[1])),
             }
-            return out
+            return {k: max(v, 0) for k, v in out.items()}
 
         def _slices(cells):
 
-            y = self.variables[self._y][:]
+            with _LOCK:
+                y = self.variables[self._y][:]
+                x = self.variables[self._x][:]
             ystart, yend = (
                 (cells["bottom"], cells["top"])
                 if y[0] <= y[-1]
@@ -87,7 +315,6 @@ class NcDimDataset(NcDataset):
             )
             yend = len(y) - yend
 
-            x = self.variables[self._x][:]
             xstart, xend = (
                 (cells["left"], cells["right"])
                 if x[0] <= x[-1]
@@ -100,12 +327,59 @@ class NcDimDataset(NcDataset):
                 self._x: slice(xstart, xend),
             }
 
-        cells = _removeCells(ymin, ymax, xmin, xmax)
-        shrink_slices = _slices(cells)
+        return _slices(_removeCells(ymin, ymax, xmin, xmax))
+
+    def timeSlice(self, start=None, end=None, timevar="time"):
+        """
+        Arguments
+        ---------
+        start   : date/str/int, first date of the period (default: first time step)
+        end     : date/str/int, last date of the period (default: last time step)
+        timevar : str, name of the time variable
+
+        Return
+        ------
+        tuple of the time dimension name and an index slice
+
+        Purpose
+        -------
+        Find the time steps between start and end (both inclusive). The
+        dates are resolved with getDates, results are memoized.
+        """
+        key = (str(start), str(end), timevar)
+        tslices = self.__dict__.setdefault("_tslices", {})
+        with _LOCK:
+            if key not in tslices:
+                days = np.array([_dateKey(d) for d in self.getDates(timevar=timevar)])
+                lower = 0 if start is None else np.searchsorted(days, _dateKey(start))
+                upper = (
+                    len(days)
+                    if end is None
+                    else np.searchsorted(days, _dateKey(end, end=True), side="right")
+                )
+                if upper <= lower:
+                    raise ValueError(
+                        "No time steps between {:} and {:} in {:}".format(
+                            start, end, self.filepath()
+                        )
+                    )
+                tslices[key] = (
+                    self.variables[timevar].dimensions[0],
+                    slice(int(lower), int(upper)),
+                )
+        return tslices[key]
+
+    def window(self, ymin, ymax, xmin, xmax):
+        """
+        Same as shrink, but returns a lazy NcDimWindow instead of a copy.
+        """
+        slices = self._shrinkSlices(ymin, ymax, xmin, xmax)
+        return NcDimWindow(self, slices[self._y], slices[self._x])
 
-        nc = NcDimDataset(
-            None, "w", self._y, self._x, self.cellsize, self.y_shift, self.x_shift
-        )
+    def shrink(self, ymin, ymax, xmin, xmax):
+        shrink_slices = self._shrinkSlices(ymin, ymax, xmin, xmax)
+
+        nc = self._emptyLike()
         nc.copyAttributes(self.attributes)
         nc.copyDimensions(self.dimensions, skip=(self._y, self._x))
         nc.createDimensions({k: (v.stop - v.start) for k, v in shrink_slices.items()})
@@ -114,9 +388,10 @@ class NcDimDataset(NcDataset):
             if any(d in var.dimensions for d in shrink_slices.keys()):
                 slices = [shrink_slices.get(d, slice(None)) for d in var.dimensions]
                 newvar = nc.copyVariable(var, data=False)
-                newvar[:] = var[slices]
+                with rawAccess(var, newvar):
+                    newvar[:] = var[slices]
             else:
-                nc.copyVariable(var, data=True)
+                nc.copyVariable(var, data=True, raw=True)
         return nc
 
     def enlarge(self, ymin, ymax, xmin, xmax):
@@ -171,9 +446,7 @@ class NcDimDataset(NcDataset):
         enlarge_slices = _slices(padding)
         coordinates = _coordinates(padding)
 
-        nc = NcDimDataset(
-            None, "w", self._y, self._x, self.cellsize, self.y_shift, self.x_shift
-        )
+        nc = self._emptyLike()
 
         nc.copyAttributes(self.attributes)
         nc.copyDimensions(self.dimensions, skip=(self._y, self._x))
@@ -186,55 +459,534 @@ class NcDimDataset(NcDataset):
                 if name in (self._y, self._x):
                     newvar[:] = coordinates[name]
                 else:
-                    newvar[slices] = var[:]
+                    with rawAccess(var, newvar):
+                        newvar[slices] = var[:]
             else:
-                nc.copyVariable(var, data=True)
+                nc.copyVariable(var, data=True, raw=True)
 
         return nc
 
     def setMask(self, mask):
         assert mask.ndim == 2, "expected a 2D mask array"
 
-        y_idx, x_idx = np.nonzero(mask)
-
-        mask_slices = {
-            self._y: y_idx,
-            self._x: x_idx,
-        }
-
-        nc = NcDimDataset(
-            None, "w", self._y, self._x, self.cellsize, self.y_shift, self.x_shift
-        )
+        nc = self._emptyLike()
         nc.copyAttributes(self.attributes)
         nc.copyDimensions(self.dimensions)
 
+        spatial = (self._y, self._x)
         for name, var in self.variables.items():
-            newvar = nc.copyVariable(var, data=True)
             if self._y in var.dimensions and self._x in var.dimensions:
-                slices = [mask_slices.get(d, slice(None)) for d in var.dimensions]
-                # do it the clunky way because of a slicing bug in netCDF4
-                data = newvar[:]
-                data[tuple(slices)] = var.fill_value
-                newvar[:] = data
+                newvar = nc.copyVariable(var, data=False)
+                vmask = _expandMask(mask, var.dimensions, *spatial)
+                # process the data in chunks to keep the memory footprint flat
+                with rawAccess(var, newvar):
+                    for slices in _chunkSlices(var, spatial, self.chunk_mb):
+                        data = var[slices]
+                        data[np.broadcast_to(vmask, data.shape)] = _fillValue(var)
+                        newvar[slices] = data
+            else:
+                nc.copyVariable(var, data=True, raw=True)
         return nc
 
     def _header(self):
         fill_value = tuple(v for v in self.fill_values.values() if v) or (None,)
-        return "\n".join(
-            [
-                "ncols\t{0}".format(len(self.variables[self._x])),
-                "nrows\t{0}".format(len(self.variables[self._y])),
-                "xllcorner\t{0}".format(self.bbox["xmin"]),
-                "yllcorner\t{0}".format(self.bbox["ymin"]),
-                "cellsize\t{0}".format(abs(self.cellsize[0])),
-                "NODATA_value\t{0}\n".format(fill_value[0]),
-            ]
+        return _asciiHeader(
+            len(self.variables[self._x]),
+            len(self.variables[self._y]),
+            self.bbox,
+            self.cellsize,
+            fill_value[0],
         )
 
     def tofile(self, fname):
         with NcDataset(fname, "w") as nc:
-            nc.copyDataset(self, vardata=True)
+            nc.copyDataset(self, vardata=True, raw=True)
         # write a header file
         path = os.path.split(fname)[0]
         with open(os.path.join(path, "header.txt"), "w") as f:
             f.write(self._header())
+
+
+class NcDimWindow(object):
+    """
+    A lazy window into a NcDimDataset.
+
+    The window is defined by index slices along the y and x dimensions of
+    the underlying dataset, an optional mask (in window coordinates), an
+    optional padding and an optional selection of index slices along
+    other dimensions (i.e. time). setMask, enlarge and period only update
+    this definition,
+    the data is read, masked, padded and written chunk by chunk in tofile.
+    So no (in-memory) copies of the data are needed.
+    """
+
+    def __init__(self, nc, yslice, xslice, mask=None, padding=None, selection=None):
+        self.nc = nc
+        self.yslice = yslice
+        self.xslice = xslice
+        self.mask = mask
+        self.padding = padding or {"top": 0, "left": 0, "bottom": 0, "right": 0}
+        self.selection = selection or {}
+
+    def rebind(self, nc):
+        """
+        The same window into nc, another handle of the same file
+        (see NcDimDataset.reopen).
+        """
+        return NcDimWindow(
+            nc, self.yslice, self.xslice, self.mask, self.padding, self.selection
+        )
+
+    def _replace(self, mask=None, padding=None, selection=None):
+        return NcDimWindow(
+            self.nc,
+            self.yslice,
+            self.xslice,
+            self.mask if mask is None else mask,
+            self.padding if padding is None else padding,
+            self.selection if selection is None else selection,
+        )
+
+    @property
+    def cellsize(self):
+        return self.nc.cellsize
+
+    @property
+    def origin(self):
+        return self.nc.origin
+
+    @property
+    def chunk_mb(self):
+        return self.nc.chunk_mb
+
+    def _before(self):
+        # padding at the start of the y and x dimension (index space)
+        ycs, xcs = self.cellsize
+        return (
+            self.padding["bottom" if ycs >= 0 else "top"],
+            self.padding["left" if xcs >= 0 else "right"],
+        )
+
+    def _after(self):
+        # padding at the end of the y and x dimension (index space)
+        ycs, xcs = self.cellsize
+        return (
+            self.padding["top" if ycs >= 0 else "bottom"],
+            self.padding["right" if xcs >= 0 else "left"],
+        )
+
+    @property
+    def shape(self):
+        # shape of the window without padding
+        with _LOCK:
+            ylen = len(self.nc.dimensions[self.nc._y])
+            xlen = len(self.nc.dimensions[self.nc._x])
+        return (
+            len(range(*self.yslice.indices(ylen))),
+            len(range(*self.xslice.indices(xlen))),
+        )
+
+    @property
+    def coordinates(self):
+        def _pad(values, step, before, after):
+            return np.concatenate(
+                [
+                    values[0] + step * np.arange(-before, 0),
+                    values,
+                    values[-1] + step * np.arange(1, after + 1),
+                ]
+            )
+
+        nc = self.nc
+        before, after = self._before(), self._after()
+        ycs, xcs = self.cellsize
+        with _LOCK:
+            yvals = np.asarray(nc.variables[nc._y][self.yslice])
+            xvals = np.asarray(nc.variables[nc._x][self.xslice])
+        return {
+            nc._y: _pad(yvals, ycs, before[0], after[0]),
+            nc._x: _pad(xvals, xcs, before[1], after[1]),
+        }
+
+    @property
+    def bbox(self):
+        coords = self.coordinates
+        y, x = coords[self.nc._y], coords[self.nc._x]
+        ycs, xcs = [abs(v) for v in self.cellsize]
+
+        return {
+            "ymin": np.min(y) - (ycs * (1 - self.nc.y_shift)),
+            "ymax": np.max(y) + (ycs * self.nc.y_shift),
+            "xmin": np.min(x) - (xcs * (1 - self.nc.x_shift)),
+            "xmax": np.max(x) + (xcs * self.nc.x_shift),
+        }
+
+    def setMask(self, mask):
+        assert mask.ndim == 2, "expected a 2D mask array"
+        # the mask is given for the (padded) window
+        (ystart, xstart), (yend, xend) = self._before(), self._after()
+        mask = np.asarray(mask, dtype=bool)
+        mask = mask[ystart : mask.shape[0] - yend, xstart : mask.shape[1] - xend]
+        if self.mask is not None:
+            mask = mask | self.mask
+        return self._replace(mask=mask)
+
+    def enlarge(self, ymin, ymax, xmin, xmax):
+        bbox = self.bbox
+        cellsize = [float(abs(v)) for v in self.cellsize]
+        padding = {
+            "top": int(np.ceil((ymax - bbox["ymax"]) / cellsize[0])),
+            "left": int(np.ceil((bbox["xmin"] - xmin) / cellsize[1])),
+            "bottom": int(np.ceil((bbox["ymin"] - ymin) / cellsize[0])),
+            "right": int(np.ceil((xmax - bbox["xmax"]) / cellsize[1])),
+        }
+        return self._replace(
+            padding={k: v + max(padding[k], 0) for k, v in self.padding.items()}
+        )
+
+    def period(self, start=None, end=None, timevar="time"):
+        """
+        Restrict the window to the time steps between start and end,
+        see NcDimDataset.timeSlice.
+        """
+        if start is None and end is None:
+            return self
+        dim, tslice = self.nc.timeSlice(start, end, timevar)
+        return self._replace(selection=dict(self.selection, **{dim: tslice}))
+
+    def _plan(self, var, offset):
+        """
+        Everything needed to place data of var into the output of the
+        window. offset gives the start of the data read along y and x
+        (i.e. the window might be part of a larger read).
+        """
+        nc = self.nc
+        spatial = (nc._y, nc._x)
+        dims = var.dimensions
+        before, after = self._before(), self._after()
+        ystart, xstart = (
+            s.indices(len(nc.dimensions[d]))[0]
+            for s, d in zip((self.yslice, self.xslice), spatial)
+        )
+        ystart, xstart = ystart - offset[0], xstart - offset[1]
+
+        vmask = None
+        if self.mask is not None and all(d in dims for d in spatial):
+            vmask = _expandMask(self.mask, dims, *spatial)
+
+        return {
+            "source": {
+                nc._y: slice(ystart, ystart + self.shape[0]),
+                nc._x: slice(xstart, xstart + self.shape[1]),
+            },
+            "inner": {
+                nc._y: slice(before[0], before[0] + self.shape[0]),
+                nc._x: slice(before[1], before[1] + self.shape[1]),
+            },
+            "padded": {
+                nc._y: self.shape[0] + before[0] + after[0],
+                nc._x: self.shape[1] + before[1] + after[1],
+            },
+            "mask": vmask,
+            "fill_value": _fillValue(var),
+        }
+
+    @staticmethod
+    def _block(data, dims, plan):
+        # cut, mask and pad the given data chunk, data is left untouched
+        data = data[tuple(plan["source"].get(d, slice(None)) for d in dims)]
+        block = np.full(
+            tuple(plan["padded"].get(d, n) for d, n in zip(dims, data.shape)),
+            plan["fill_value"],
+            dtype=data.dtype,
+        )
+        inner = block[tuple(plan["inner"].get(d, slice(None)) for d in dims)]
+        inner[...] = data
+        if plan["mask"] is not None:
+            inner[np.broadcast_to(plan["mask"], inner.shape)] = plan["fill_value"]
+        return block
+
+    def _create(self, fname, zlib=None, complevel=None, chunksizes=None):
+        # create the output file, with everything but the spatial data
+        nc = self.nc
+        spatial = (nc._y, nc._x)
+        coordinates = self.coordinates
+        lengths = {k: len(v) for k, v in nc.dimensions.items()}
+        lengths.update({k: len(v) for k, v in coordinates.items()})
+        lengths.update({k: v.stop - v.start for k, v in self.selection.items()})
+        # compression settings of the input are kept, if not given
+        params = {
+            k: v for k, v in (("zlib", zlib), ("complevel", complevel)) if v is not None
+        }
+        out = NcDataset(fname, "w")
+        out.set_fill_off()
+        out.copyAttributes(nc.attributes)
+        out.copyDimensions(nc.dimensions, skip=spatial + tuple(self.selection))
+        out.createDimensions({k: len(v) for k, v in coordinates.items()})
+        for dim in self.selection:
+            unlimited = nc.dimensions[dim].isunlimited()
+            out.createDimension(dim, None if unlimited else lengths[dim])
+
+        for name, var in nc.variables.items():
+            if name in coordinates:
+                outvar = out.copyVariable(var, data=False)
+                outvar[:] = coordinates[name]
+            elif nc._y in var.dimensions or nc._x in var.dimensions:
+                shape = tuple(lengths[d] for d in var.dimensions)
+                out.copyVariable(
+                    var,
+                    data=False,
+                    chunksizes=_outputChunks(var, shape, spatial, chunksizes),
+                    **params,
+                )
+            elif any(d in self.selection for d in var.dimensions):
+                slices = tuple(
+                    self.selection.get(d, slice(None)) for d in var.dimensions
+                )
+                with rawAccess(var):
+                    data = var[slices]
+                out.copyVariable(var, data=data, raw=True)
+            else:
+                out.copyVariable(var, data=True, raw=True)
+        return out
+
+    def _writeHeader(self, fname):
+        nc = self.nc
+        # the attributes of all variables are read from the dataset
+        with _LOCK:
+            coordinates = self.coordinates
+            fill_value = tuple(v for v in nc.fill_values.values() if v) or (None,)
+            header = _asciiHeader(
+                len(coordinates[nc._x]),
+                len(coordinates[nc._y]),
+                self.bbox,
+                self.cellsize,
+                fill_value[0],
+            )
+        path = os.path.split(fname)[0]
+        with open(os.path.join(path, "header.txt"), "w") as f:
+            f.write(header)
+
+    def tofile(self, fname, zlib=None, complevel=None, chunksizes=None, reopen=False):
+        return writeWindows(
+            [self],
+            [fname],
+            zlib=zlib,
+            complevel=complevel,
+            chunksizes=chunksizes,
+            reopen=reopen,
+        )
+
+
+def _readPlan(var, windows, bounds, offset, cache_mb, chunk_mb):
+    """
+    The chunks to read from var (relative to and within bounds), the
+    placement plans of all windows and the chunk cache plan.
+    """
+    nc = windows[0].nc
+    spatial = (nc._y, nc._x)
+    dims = var.dimensions
+    shape = tuple(
+        bounds[d].stop - bounds[d].start if d in bounds else n
+        for d, n in zip(dims, var.shape)
+    )
+    chunking = var.chunking()
+    align = None
+    if not isinstance(chunking, str):
+        align = next((c for d, c in zip(dims, chunking) if d not in spatial), None)
+    chunks = list(_chunkSlices(var, spatial, chunk_mb, shape=shape, align=align))
+    reads = [
+        tuple(_within(c, bounds[d]) if d in bounds else c for d, c in zip(dims, chunk))
+        for chunk in chunks
+    ]
+    plans = [w._plan(var, offset) for w in windows]
+    return chunks, reads, plans, _cachePlan(var, reads, cache_mb)
+
+
+def _writeWindows(windows, fnames, **varparams):
+    # all netCDF calls hold _LOCK, only the numpy work runs concurrently
+    with _LOCK:
+        nc = windows[0].nc
+        if any(w.nc is not nc for w in windows):
+            raise ValueError("All windows need to share the same dataset")
+
+        spatial = (nc._y, nc._x)
+        # the union of all windows, this is what is read from the input
+        bounds = {}
+        for dim, attr in zip(spatial, ("yslice", "xslice")):
+            length = len(nc.dimensions[dim])
+            idx = [getattr(w, attr).indices(length)[:2] for w in windows]
+            bounds[dim] = slice(min(i[0] for i in idx), max(i[1] for i in idx))
+        offset = tuple(bounds[d].start for d in spatial)
+
+        selection = windows[0].selection
+        if any(w.selection != selection for w in windows):
+            raise ValueError("All windows need to share the same selection")
+        bounds.update(selection)
+
+        variables = [
+            (name, var)
+            for name, var in nc.variables.items()
+            if name not in spatial and any(d in var.dimensions for d in spatial)
+        ]
+        outs = [w._create(f, **varparams) for w, f in zip(windows, fnames)]
+
+    stats = {}
+    try:
+        for name, var in variables:
+            with _LOCK:
+                chunks, reads, plans, cache = _readPlan(
+                    var, windows, bounds, offset, nc.cache_mb, nc.chunk_mb
+                )
+                if cache:
+                    default = var.get_var_chunk_cache()
+                    # never shrink the cache below the library default
+                    cache["size"] = max(cache["size"], default[0])
+                    var.set_var_chunk_cache(cache["size"], cache["nelems"], 0.0)
+                    stats[name] = cache
+                outvars = [out.variables[name] for out in outs]
+            try:
+                # data is copied as stored, masked/padded cells get the raw fill value
+                with rawAccess(var, *outvars):
+                    for chunk, read in zip(chunks, reads):
+                        with _LOCK:
+                            data = var[read]
+                        blocks = [
+                            w._block(data, var.dimensions, p)
+                            for w, p in zip(windows, plans)
+                        ]
+                        with _LOCK:
+                            for outvar, block in zip(outvars, blocks):
+                                outvar[chunk] = block
+            finally:
+                if cache:
+                    with _LOCK:
+                        var.set_var_chunk_cache(*default)
+    finally:
+        with _LOCK:
+            for out in outs:
+                out.close()
+
+    for window, fname in zip(windows, fnames):
+        window._writeHeader(fname)
+
+    return stats
+
+
+def _openLimit():
+    """
+    The number of output files, which can be open at once. The soft limit
+    of open files of the process is raised to its hard limit, if possible.
+    """
+    try:
+        import resource
+    except ImportError:
+        # e.g. on Windows
+        return MAX_OPEN
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+            soft = hard
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        soft = MAX_OPEN + RESERVED_FILES
+    return max(soft - RESERVED_FILES, 1)
+
+
+def _spatialOrder(windows):
+    """
+    Indices of the given windows along a Hilbert curve over their centers,
+    i.e. consecutive windows are neighbours.
+    """
+    nc = windows[0].nc
+    lengths = [len(nc.dimensions[d]) for d in (nc._y, nc._x)]
+    bits = max(int(np.ceil(np.log2(max(lengths + [2])))), 1)
+    centers = np.array(
+        [
+            [sum(s.indices(n)[:2]) // 2 for s, n in zip((w.yslice, w.xslice), lengths)]
+            for w in windows
+        ]
+    )
+    return np.argsort(hilbertIndex(centers[:, 0], centers[:, 1], bits), kind="stable")
+
+
+def writeWindows(
+    windows,
+    fnames,
+    max_open=None,
+    zlib=None,
+    complevel=None,
+    chunksizes=None,
+    reopen=False,
+):
+    """
+    Arguments
+    ---------
+    windows    : list of NcDimWindow, all based on the same NcDimDataset
+    fnames     : list of str, output file names
+    max_open   : int, maximum number of output files open at once
+                 (default: the limit of open files, see _openLimit)
+    zlib       : bool, compress the spatial output variables
+                 (default: as in the input)
+    complevel  : int, compression level 1-9 (default: as in the input)
+    chunksizes : dict, chunk size per dimension name of the spatial output
+                 variables (default: see _outputChunks)
+    reopen     : bool, read from a new handle of the input file, i.e. the
+                 windows' dataset is not touched by other threads
+
+    Return
+    ------
+    dict, the chunk cache plan and hit/miss estimates per variable
+    (see _cachePlan)
+
+    Purpose
+    -------
+    Write the given windows to the given files. The input data is read
+    only once, in chunks covering all windows, each chunk is then
+    scattered into all output files. This turns one full read of the
+    input per gauge into a single sequential read.
+    More than max_open windows are written in batches of neighbouring
+    windows (see _spatialOrder). The input is then read once per batch,
+    but only within the extent of its windows.
+    netCDF/HDF5 is not thread-safe, so library calls are serialized by a
+    global lock and only the masking/padding runs concurrently.
+    """
+    if reopen:
+        with _LOCK:
+            nc = windows[0].nc.reopen()
+        try:
+            return writeWindows(
+                [w.rebind(nc) for w in windows],
+                fnames,
+                max_open,
+                zlib,
+                complevel,
+                chunksizes,
+            )
+        finally:
+            with _LOCK:
+                nc.close()
+
+    if max_open is None:
+        max_open = _openLimit()
+    if len(windows) > max_open:
+        order = _spatialOrder(windows)
+        windows = [windows[i] for i in order]
+        fnames = [fnames[i] for i in order]
+
+    stats = {}
+    for start in range(0, len(windows), max_open):
+        batch = _writeWindows(
+            windows[start : start + max_open],
+            fnames[start : start + max_open],
+            zlib=zlib,
+            complevel=complevel,
+            chunksizes=chunksizes,
+        )
+        for name, cache in batch.items():
+            total = stats.setdefault(name, dict(cache, accesses=0, hits=0, misses=0))
+            for key in ("accesses", "hits", "misses"):
+                total[key] += cache[key]
+    return stats
@@ -14,6 +14,8 @@ netCDF4 counterparts.
 
 import uuid
 from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
 
 from netCDF4 import Dataset, Dimension, Group, Variable, num2date
 
@@ -37,6 +39,7 @@ def copyGroup(
     fixdims=False,
     vardata=False,
     varparams=None,
+    raw=False,
 ):
     """
     Arguments
@@ -57,6 +60,8 @@ def copyGroup(
     vardata (optional)    : boolean, copy variable data
     varparams(optional)   : dict, variable paramaters will be passed to
                             createVariable (i.e. zlib, complevel, chunksizes, ...)
+    raw (optional)        : boolean, copy the variable data as stored
+                            (see copyVariable)
 
     Return
     ------
@@ -69,7 +74,9 @@ def copyGroup(
     out = ncin.createGroup(group.name)
     out.set_fill_off()
     out.copyDimensions(group.dimensions, skip=skipdims, fix=fixdims)
-    out.copyVariables(group.variables, skip=skipvars, data=vardata, varparams=varparams)
+    out.copyVariables(
+        group.variables, skip=skipvars, data=vardata, varparams=varparams, raw=raw
+    )
     out.copyAttributes(group.attributes, skipattrs)
     out.copyGroups(group.groups, skipgroups)
     return out
@@ -85,6 +92,7 @@ def copyDataset(
     fixdims=False,
     vardata=False,
     varparams=None,
+    raw=False,
 ):
     """
     Arguments
@@ -105,6 +113,8 @@ def copyDataset(
     vardata (optional)    : boolean, copy variable data
     varparams(optional)   : dict, variable paramaters will be passed to
                             createVariable (i.e. zlib, complevel, chunksizes, ...)
+    raw (optional)        : boolean, copy the variable data as stored
+                            (see copyVariable)
 
 
     Return
@@ -118,7 +128,7 @@ def copyDataset(
     ncin.set_fill_off()
     ncin.copyDimensions(group.dimensions, skip=skipdims, fix=fixdims)
     ncin.copyVariables(
-        group.variables, skip=skipvars, data=vardata, varparams=varparams
+        group.variables, skip=skipvars, data=vardata, varparams=varparams, raw=raw
     )
     ncin.copyAttributes(group.attributes, skipattrs)
     ncin.copyGroups(group.groups, skipgroups)
@@ -234,7 +244,37 @@ def copyAttributes(ncin, attributes, skip=None):
             ncin.createAttribute(k, v)
 
 
-def copyVariable(ncin, var, data=True, dims=False, fail=True, **kwargs):
+@contextmanager
+def _noop():
+    yield
+
+
+@contextmanager
+def rawAccess(*variables):
+    """
+    Arguments
+    ---------
+    variables : Instances of NcVariable
+
+    Purpose
+    -------
+    Disable the automatic masking and scaling of the given variables
+    within the context, i.e. data is read and written as stored in the
+    file. Copies are then byte-for-byte and skip the (expensive) masked
+    array creation and the unpacking/repacking of scaled values.
+    """
+    states = [(var, var.mask, var.scale) for var in variables]
+    for var in variables:
+        var.set_auto_maskandscale(False)
+    try:
+        yield
+    finally:
+        for var, mask, scale in states:
+            var.set_auto_mask(mask)
+            var.set_auto_scale(scale)
+
+
+def copyVariable(ncin, var, data=True, dims=False, fail=True, raw=False, **kwargs):
     """
     Arguments
     ---------
@@ -244,6 +284,8 @@ def copyVariable(ncin, var, data=True, dims=False, fail=True, **kwargs):
     data (optional) : boolean, copy variable data
     dims (Optional[bool]): copy missing dimensions
     fail (Optional[bool]): raise an exception if variable exists, ignored at the moment
+    raw (Optional[bool]): copy the data as stored, without masking and scaling.
+                          A given data array needs to be raw (packed) as well.
     kwargs          : will be passed to createVariable. Allows to set
                       parameters like chunksizes, deflate_level, ...
 
@@ -280,16 +322,24 @@ def copyVariable(ncin, var, data=True, dims=False, fail=True, **kwargs):
         invar = ncin.variables[vname]
 
     invar.copyAttributes(var.attributes)
-    if data is True and var.shape:
-        invar[:] = var[:]
-    elif data is not False:
-        # i.e. if an array is given
-        invar[:] = data
+    with rawAccess(var, invar) if raw else _noop():
+        if data is True and var.shape:
+            invar[:] = var[:]
+        elif data is not False:
+            # i.e. if an array is given
+            invar[:] = data
     return invar
 
 
 def copyVariables(
-    ncin, variables, skip=None, data=True, dims=False, fail=True, varparams=None
+    ncin,
+    variables,
+    skip=None,
+    data=True,
+    dims=False,
+    fail=True,
+    varparams=None,
+    raw=False,
 ):
     """
     Arguments
@@ -306,6 +356,7 @@ def copyVariables(
     fail (Optional[bool])   : raise an exception if a variable already exists
     varparams(optional)     : dict, variable paramaters will be passed to
                               createVariable (i.e. zlib, complevel, chunksizes, ...)
+    raw (optional)          : boolean, copy the data as stored (see copyVariable)
 
     Return
     ------
@@ -320,7 +371,7 @@ def copyVariables(
         varparams = dict()
     for v in variables.values():
         if v.name not in _tupelize(skip):
-            ncin.copyVariable(v, data, dims, fail, **varparams)
+            ncin.copyVariable(v, data, dims, fail, raw, **varparams)
 
 
 def createDimensions(ncin, dim_dict, fail=True):
@@ -533,17 +584,29 @@ def filterDimensions(ncin, lengths):
     )
 
 
+def _wrapGroup(ncin, grp):
+    return NcGroup(ncin, grp.name, id=grp._grpid)
+
+
+def _wrapVariable(ncin, var):
+    return NcVariable(ncin, var.name, var.dtype, var.dimensions, id=var._varid)
+
+
+def _wrapDimension(ncin, dim):
+    return NcDimension(ncin, dim.name, id=dim._dimid)
+
+
 def getGroups(ncin):
     out = OrderedDict()
     for g in getattr(ncin, "groups").values():
-        out[g.name] = NcGroup(ncin, g.name, id=g._grpid)
+        out[g.name] = _wrapGroup(ncin, g)
     return out
 
 
 def getVariables(ncin):
     out = OrderedDict()
     for v in getattr(ncin, "variables").values():
-        out[v.name] = NcVariable(ncin, v.name, v.dtype, v.dimensions, id=v._varid)
+        out[v.name] = _wrapVariable(ncin, v)
     return out
 
 
@@ -551,10 +614,61 @@ def getDimensions(ncin):
 
     out = OrderedDict()
     for dim in getattr(ncin, "dimensions").values():
-        out[dim.name] = NcDimension(ncin, dim.name, id=dim._dimid)
+        out[dim.name] = _wrapDimension(ncin, dim)
     return out
 
 
+class _LazyDict(OrderedDict):
+    """
+    An ordered dictionary, wrapping its values on first access.
+
+    Used for the groups, dimensions and variables of NcDataset/NcGroup,
+    so only the objects actually accessed are converted into their
+    Nc* counterparts.
+    """
+
+    def __init__(self, wrap, items=()):
+        super(_LazyDict, self).__init__(items)
+        self._wrap = wrap
+
+    def __getitem__(self, key):
+        value = super(_LazyDict, self).__getitem__(key)
+        if not isinstance(value, (NcGroup, NcVariable, NcDimension)):
+            value = self._wrap(value)
+            super(_LazyDict, self).__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def pop(self, key, *args):
+        if key in self:
+            value = self[key]
+            del self[key]
+            return value
+        return super(_LazyDict, self).pop(key, *args)
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def copy(self):
+        return _LazyDict(self._wrap, ((k, self[k]) for k in self))
+
+
+def _wrapLazy(ncin):
+    # the netCDF4 attributes can't be rebound through __setattr__
+    for name, wrap in (
+        ("groups", _wrapGroup),
+        ("dimensions", _wrapDimension),
+        ("variables", _wrapVariable),
+    ):
+        lazy = _LazyDict(partial(wrap, ncin), getattr(ncin, name))
+        getattr(Dataset, name).__set__(ncin, lazy)
+
+
 def getAttributes(ncin):
     out = OrderedDict()
     for k in ncin.ncattrs():
@@ -635,17 +749,12 @@ class NcDataset(Dataset):
         )
 
         self.fname = filename
-        for k, v in zip(self.groups, getGroups(self).values()):
-            self.groups[k] = v
-        for k, v in zip(self.dimensions, getDimensions(self).values()):
-            self.dimensions[k] = v
-        for k, v in zip(self.variables, getVariables(self).values()):
-            self.variables[k] = v
+        _wrapLazy(self)
 
     def tofile(self, fname):
         # preserve dataset options
         with NcDataset(fname, "w") as out:
-            out.copyDataset(self, vardata=True)
+            out.copyDataset(self, vardata=True, raw=True)
 
     # def __enter__(self):
     #     return self
@@ -679,12 +788,7 @@ class NcDataset(Dataset):
 class NcGroup(Group):
     def __init__(self, *args, **kwargs):
         super(NcGroup, self).__init__(*args, **kwargs)
-        for k, v in zip(self.groups, getGroups(self).values()):
-            self.groups[k] = v
-        for k, v in zip(self.dimensions, getDimensions(self).values()):
-            self.dimensions[k] = v
-        for k, v in zip(self.variables, getVariables(self).values()):
-            self.variables[k] = v
+        _wrapLazy(self)
 
     copyDimension = copyDimension
     copyDimensions = copyDimensions
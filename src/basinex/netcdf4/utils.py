@@ -1,10 +1,20 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from netcdf4 import NcDataset
 
+from .netcdf4 import NcDataset
 
-def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
+
+def _chunks(var, axis, chunk_mb):
+    # slices of about chunk_mb megabytes along the given axis
+    length = var.shape[axis]
+    slab = var.dtype.itemsize * int(np.prod(var.shape)) // max(length, 1)
+    step = max(1, int(chunk_mb * 2**20) // max(slab, 1))
+    for start in range(0, length, step):
+        yield slice(start, min(start + step, length))
+
+
+def concatDimension(fnames, dim, dimvar=None, outfname=None, chunk_mb=256, **kwargs):
     """
     Arguments:
     ----------
@@ -14,6 +24,8 @@ def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
                                    for the concatenation dimension,
                                    default: dimvar = dim
     outfname (Optional[str]):      file name of an output dataset
+    chunk_mb (Optional[float]):    size of the data chunks copied at once
+                                   in MB, default: 256
     kwargs (Optional[Any]):        paramaters to pass to the createVariable
                                    Method of NcDataset
 
@@ -29,6 +41,9 @@ def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
     variable name is the same as the concatenation dimension).
     If 'outfname' is given the concatenation is file based, otherwise an in-memory
     dataset will be returned.
+    Variables are copied in chunks along 'dim', variables without 'dim'
+    are only written once (from the first dataset containing them). The
+    attributes of 'dimvar' are copied from the first dataset.
     """
 
     def getDimVarValues(fnames, vardim):
@@ -39,10 +54,12 @@ def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
                 # TODO:
                 # check if values are given, otherwise make up
                 # some fake data simpling starting at 0
-                data = nc.variables[vardim][:]
+                data = np.ma.getdata(nc.variables[vardim][:])
                 types.append(data.dtype)
-                vals.extend(data.tolist())
-        return np.unique(vals).astype(dtype=np.find_common_type(types, []))
+                vals.append(data.ravel())
+        return np.unique(np.concatenate(vals)).astype(
+            dtype=np.find_common_type(types, [])
+        )
 
     def getCommonVarTypes(fnames):
         vars = {}
@@ -69,6 +86,9 @@ def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
     var = out.createVariable(dimvar, dimvals.dtype, (dim,), fail=False, **kwargs)
     var[:] = dimvals
 
+    # variables without the concat dimension already written
+    written = set([dimvar])
+
     for i, fname in enumerate(fnames):
 
         with NcDataset(fname, "r") as nc:
@@ -76,34 +96,59 @@ def concatDimension(fnames, dim, dimvar=None, outfname=None, **kwargs):
             out.copyDimensions(nc.dimensions, skip=out.dimensions, fix=True)
             out.copyAttributes(nc.attributes)
 
+            if i == 0:
+                # the values of dimvar are written above, its attributes
+                # (e.g. units, calendar) are needed to decode them
+                out.variables[dimvar].copyAttributes(nc.variables[dimvar].attributes)
+
+            # positions of the dataset's values along the concat dimension,
+            # dimvals is sorted and unique
+            values = np.ma.getdata(nc.variables[dimvar][:]).astype(dimvals.dtype)
+            idx = np.searchsorted(dimvals, values)
+            contiguous = idx.size and np.all(np.diff(idx) == 1)
+
             for vname, var in nc.variables.items():
 
-                outvar = out.copyVariable(
-                    var, dtype=dtypes[vname], data=False, fail=False, **kwargs
-                )
+                if vname in written:
+                    continue
 
-                # build up the indices
-                if dim in var.dimensions:
-                    # idx = [dimvals.index(v) for v in nc.variables[dimvar]]
-                    idx = [np.where(dimvals == v)[0][0] for v in nc.variables[dimvar]]
-                    slices = [
-                        slice(
-                            None,
-                        )
-                    ] * len(var.dimensions)
-                    slices[var.dimensions.index(dim)] = idx
+                if vname in out.variables:
+                    outvar = out.variables[vname]
                 else:
-                    # writing them again is stupid...
-                    slices = slice(None)
+                    outvar = out.copyVariable(
+                        var, dtype=dtypes[vname], data=False, fail=False, **kwargs
+                    )
 
-                data = var[:]
+                if dim in var.dimensions:
+                    axis = var.dimensions.index(dim)
+                    chunks = _chunks(var, axis, chunk_mb)
+                else:
+                    # invariant variables are written only once
+                    axis, chunks = None, (None,)
+                    written.add(vname)
+
+                for chunk in chunks:
+                    slices = [slice(None)] * len(var.dimensions)
+                    outslices = list(slices)
+                    if chunk is not None:
+                        slices[axis] = chunk
+                        outslices[axis] = (
+                            slice(idx[0] + chunk.start, idx[0] + chunk.stop)
+                            if contiguous
+                            else idx[chunk]
+                        )
 
-                # this seems to be necessary, because netCDF4 sometimes comes
-                # up with a masked without a explicit user definition
-                # (i.e. no fill_value, valid_range, whatever is set)
-                if isinstance(data, np.ma.MaskedArray):
-                    data = data.data
-                outvar[slices] = data
+                    data = var[tuple(slices)] if slices else var[...]
+
+                    # this seems to be necessary, because netCDF4 sometimes comes
+                    # up with a masked without a explicit user definition
+                    # (i.e. no fill_value, valid_range, whatever is set)
+                    if isinstance(data, np.ma.MaskedArray):
+                        data = data.data
+                    if outslices:
+                        outvar[tuple(outslices)] = data
+                    else:
+                        outvar[...] = data
 
     if outfname is None:
         return out
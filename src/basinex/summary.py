@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+"""
+Purpose
+-------
+Run level summary of the extracted basins. Every gauge adds one row to
+a CSV table as soon as it is finished. Rows are appended with a single
+write to a file opened in append mode (and locked, where supported), so
+several runs (e.g. one per '--line') can share the same table.
+"""
+
+import csv
+import io
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: nocover
+    # e.g. Windows, appends are not locked
+    fcntl = None
+
+SUMMARY_FIELDS = (
+    "id",
+    "status",
+    "calculated_size",
+    "input_size",
+    "error_size",
+    "adjusted_y",
+    "adjusted_x",
+    "ncells",
+    "ymin",
+    "ymax",
+    "xmin",
+    "xmax",
+    "time_mask",
+    "time_extract",
+    "time_write",
+    "time_total",
+    "worker",
+    "message",
+)
+
+
+class Summary(object):
+    def __init__(self, fname):
+        self.fname = fname
+        self._lock = threading.Lock()
+        path = os.path.dirname(fname)
+        if path:
+            os.makedirs(path, exist_ok=True)
+
+    def _format(self, row):
+        out = io.StringIO()
+        writer = csv.DictWriter(
+            out, fieldnames=SUMMARY_FIELDS, extrasaction="ignore", lineterminator="\n"
+        )
+        writer.writerow(
+            {k: "" if row.get(k) is None else row.get(k) for k in SUMMARY_FIELDS}
+        )
+        return out.getvalue()
+
+    def add(self, row):
+        """
+        Arguments
+        ---------
+        row : dict  # values of the gauge, missing fields are left empty
+
+        Returns
+        -------
+        None
+
+        Purpose
+        -------
+        Append the given row to the summary table. The header is written
+        by the first process, that finds an empty file.
+        """
+        line = self._format(row)
+        with self._lock:
+            fd = os.open(self.fname, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                if fcntl is not None:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size == 0:
+                    line = ",".join(SUMMARY_FIELDS) + "\n" + line
+                os.write(fd, line.encode("utf-8"))
+            finally:
+                # closing the file releases the lock
+                os.close(fd)
@@ -3,16 +3,48 @@
 
 
 class NcFile(object):
-    def __init__(self, fname, ydim, xdim, outpath=None, y_shift=1, x_shift=0):
+    def __init__(
+        self,
+        fname,
+        ydim,
+        xdim,
+        outpath=None,
+        y_shift=1,
+        x_shift=0,
+        chunk_mb=None,
+        cache_mb=None,
+        zlib=None,
+        complevel=None,
+        chunksizes=None,
+        start=None,
+        end=None,
+    ):
         self.fname = fname
         self.ydim = ydim
         self.xdim = xdim
         self.outpath = outpath
         self.y_shift = y_shift
         self.x_shift = x_shift
+        self.chunk_mb = chunk_mb
+        self.cache_mb = cache_mb
+        self.zlib = zlib
+        self.complevel = complevel
+        self.chunksizes = chunksizes
+        self.start = start
+        self.end = end
+
+    @property
+    def varparams(self):
+        # creation parameters of the output variables
+        return {
+            "zlib": self.zlib,
+            "complevel": self.complevel,
+            "chunksizes": self.chunksizes,
+        }
 
 
 class GridFile(object):
-    def __init__(self, fname, outpath=None):
+    def __init__(self, fname, outpath=None, options=None):
         self.fname = fname
         self.outpath = outpath
+        self.options = options